@@ -15,14 +15,66 @@ class Config:
     db_name: str = getenv("DB_NAME")
     db_user: str = getenv("DB_USER")
     db_password: str = getenv("DB_PASSWORD")
+    db_pool_min_size: int = int(getenv("DB_POOL_MIN_SIZE", 1))
+    db_pool_max_size: int = int(getenv("DB_POOL_MAX_SIZE", 10))
+    db_pool_max_inactive_lifetime: float = float(
+        getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300)
+    )
+    row_cache_size: int = int(getenv("ROW_CACHE_SIZE", 1000))
+    row_cache_ttl: float = float(getenv("ROW_CACHE_TTL", 60))
+    db_migration_batch_size: int = int(getenv("DB_MIGRATION_BATCH_SIZE", 1000))
     google_sheets_credentials_file: str = getenv("GOOGLE_SHEETS_CREDENTIALS_FILE")
     google_sheets_categories_sheet_id: int = getenv("GOOGLE_SHEETS_CATEGORIES_SHEET_ID")
     google_sheets_records_sheet_id: int = getenv("GOOGLE_SHEETS_RECORDS_SHEET_ID")
+    google_sheets_reauth_interval: int = int(getenv("GOOGLE_SHEETS_REAUTH_INTERVAL", 45))
+    sheets_outbox_poll_interval: float = float(getenv("SHEETS_OUTBOX_POLL_INTERVAL", 5))
+    sheets_outbox_batch_size: int = int(getenv("SHEETS_OUTBOX_BATCH_SIZE", 50))
+    sheets_outbox_flush_interval: float = float(
+        getenv("SHEETS_OUTBOX_FLUSH_INTERVAL", 2)
+    )
+    sheets_outbox_max_attempts: int = int(getenv("SHEETS_OUTBOX_MAX_ATTEMPTS", 10))
+    sheets_outbox_backoff_base: float = float(getenv("SHEETS_OUTBOX_BACKOFF_BASE", 5))
+    sheets_outbox_backoff_max: float = float(getenv("SHEETS_OUTBOX_BACKOFF_MAX", 3600))
+    sheets_outbox_lease: float = float(getenv("SHEETS_OUTBOX_LEASE", 120))
+    sheets_backend: str = getenv("SHEETS_BACKEND", "google")
+    sheets_local_dir: str = getenv("SHEETS_LOCAL_DIR", "sheets_data")
+    sheets_memory_seed_dir: str | None = getenv("SHEETS_MEMORY_SEED_DIR")
+    sheets_fake_latency: float = float(getenv("SHEETS_FAKE_LATENCY", 0))
+    sheets_fake_error_rate: float = float(getenv("SHEETS_FAKE_ERROR_RATE", 0))
+    sheets_reconcile_interval: float = float(getenv("SHEETS_RECONCILE_INTERVAL", 900))
+    sheets_reconcile_batch_size: int = int(getenv("SHEETS_RECONCILE_BATCH_SIZE", 200))
+    sheets_reconcile_grace: float = float(getenv("SHEETS_RECONCILE_GRACE", 60))
+    sheets_read_quota: float = float(getenv("SHEETS_READ_QUOTA", 60))
+    sheets_write_quota: float = float(getenv("SHEETS_WRITE_QUOTA", 60))
+    sheets_rate_burst: float = float(getenv("SHEETS_RATE_BURST", 10))
+    sheets_retry_attempts: int = int(getenv("SHEETS_RETRY_ATTEMPTS", 5))
+    sheets_request_timeout: float = float(getenv("SHEETS_REQUEST_TIMEOUT", 30))
+    sheets_retry_backoff_base: float = float(getenv("SHEETS_RETRY_BACKOFF_BASE", 1))
+    sheets_retry_backoff_max: float = float(getenv("SHEETS_RETRY_BACKOFF_MAX", 32))
+    categories_cache_ttl: float = float(getenv("CATEGORIES_CACHE_TTL", 900))
+    categories_refresh_interval: float = float(
+        getenv("CATEGORIES_REFRESH_INTERVAL", 300)
+    )
     head_chat_ids: list[int] = list(map(int, getenv("HEAD_CHAT_IDS").split(",")))
     finance_chat_ids: list[int] = list(map(int, getenv("FINANCE_CHAT_IDS").split(",")))
     payment_chat_ids: list[int] = list(map(int, getenv("PAYMENT_CHAT_IDS").split(",")))
     initiator_chat_ids: list[int] = list(map(int, getenv("INITIATOR_CHAT_IDS").split(",")))
     developer_chat_id: list[int] = getenv("DEVELOPER_CHAT_ID")
+    admin_chat_ids: list[int] = [
+        int(chat_id)
+        for chat_id in getenv("ADMIN_CHAT_IDS", getenv("DEVELOPER_CHAT_ID", "")).split(",")
+        if chat_id
+    ]
+    telegram_send_concurrency: int = int(getenv("TELEGRAM_SEND_CONCURRENCY", 10))
+    telegram_global_rate: float = float(getenv("TELEGRAM_GLOBAL_RATE", 25))
+    telegram_chat_interval: float = float(getenv("TELEGRAM_CHAT_INTERVAL", 1))
+    telegram_retry_attempts: int = int(getenv("TELEGRAM_RETRY_ATTEMPTS", 3))
+    message_state_flush_interval: float = float(
+        getenv("MESSAGE_STATE_FLUSH_INTERVAL", 1)
+    )
+    message_manager_max_size: int = int(getenv("MESSAGE_MANAGER_MAX_SIZE", 1000))
+    message_manager_idle_ttl: float = float(getenv("MESSAGE_MANAGER_IDLE_TTL", 86400))
+    not_paid_page_size: int = int(getenv("NOT_PAID_PAGE_SIZE", 5))
     white_list: set[int] = set(map(int, getenv("WHITE_LIST").split(",")))
 
     DEPARTMENTS = {
@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+
+
+class RowCache:
+    """Ограниченный по размеру кэш строк hr_approvals с TTL и вытеснением LRU"""
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Инициализирует объект RowCache.
+
+        :param max_size: Максимальное количество строк в кэше
+        :param ttl: Время жизни строки в кэше в секундах
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        # кэш включается только при активной подписке на уведомления об изменениях
+        self.enabled = False
+        self._rows: OrderedDict[int, tuple[float, dict[str, any]]] = OrderedDict()
+        # увеличивается при каждой инвалидации, чтобы не сохранить в кэш строку,
+        # прочитанную до изменения
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, row_id: int) -> dict[str, any] | None:
+        """
+        Возвращает копию строки из кэша, если она есть и не устарела.
+
+        :param row_id: ID строки
+        :return: Словарь с данными строки или None
+        """
+
+        if not self.enabled:
+            return None
+
+        entry = self._rows.get(row_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._rows[row_id]
+            self.misses += 1
+            return None
+
+        self._rows.move_to_end(row_id)
+        self.hits += 1
+        return dict(entry[1])
+
+    def put(
+        self, row_id: int, row: dict[str, any], generation: int | None = None
+    ) -> None:
+        """
+        Сохраняет строку в кэш, вытесняя самую давно использованную при переполнении.
+
+        :param row_id: ID строки
+        :param row: Словарь с данными строки
+        :param generation: Поколение кэша на момент чтения строки из базы данных;
+            если с тех пор была инвалидация, строка не сохраняется, а прежняя
+            версия строки удаляется из кэша
+        """
+
+        if not self.enabled or self.max_size <= 0:
+            return
+        if generation is not None and generation != self.generation:
+            self._rows.pop(row_id, None)
+            return
+
+        self._rows[row_id] = (time.monotonic() + self.ttl, dict(row))
+        self._rows.move_to_end(row_id)
+        while len(self._rows) > self.max_size:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, row_id: int) -> None:
+        """
+        Удаляет строку из кэша.
+
+        :param row_id: ID строки
+        """
+
+        self.generation += 1
+        self.invalidations += 1
+        self._rows.pop(row_id, None)
+
+    def clear(self) -> None:
+        """Полностью очищает кэш."""
+
+        self.generation += 1
+        self._rows.clear()
+
+    def stats(self) -> dict[str, int | bool]:
+        """
+        Возвращает счетчики работы кэша.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {
+            "enabled": self.enabled,
+            "size": len(self._rows),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
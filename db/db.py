@@ -1,9 +1,42 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable
+
 import asyncpg
 from config.config import Config
+from db.cache import RowCache
+from db.migrations import run_migrations
+from db.statements import (
+    EVENT_COLUMNS,
+    INSERT_COLUMNS,
+    STATEMENTS,
+    get_value_statement,
+    update_statement,
+)
 from helper.logging_config import logger
 from helper.user_data import get_nickname
 
 
+# канал уведомлений об изменении строк hr_approvals (см. миграцию 4)
+CHANGES_CHANNEL = "hr_approvals_changed"
+# задержка перед повторной подпиской на уведомления в секундах
+LISTENER_RETRY_DELAY = 5
+
+
+class ApprovalConnection(asyncpg.Connection):
+    """Соединение пула с подготовленными именованными запросами"""
+
+    def __init__(self, *args, **kwargs):
+        """
+        Инициализирует объект ApprovalConnection.
+
+        Создает пустой словарь подготовленных запросов этого соединения.
+        """
+
+        super().__init__(*args, **kwargs)
+        self.prepared_statements: dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+
 class ApprovalDB:
     """База данных для хранения данных о заявке"""
 
@@ -11,7 +44,8 @@ class ApprovalDB:
         """
         Инициализирует объект ApprovalDB.
 
-        Создает словарь параметров подключения к базе данных.
+        Создает словари параметров подключения к базе данных и пула соединений
+        и кэш строк. Сам пул создается лениво при первом обращении к базе данных.
         """
 
         self.db_params = {
@@ -21,70 +55,178 @@ class ApprovalDB:
             "user": Config.db_user,
             "password": Config.db_password,
         }
+        self.pool_params = {
+            "min_size": Config.db_pool_min_size,
+            "max_size": Config.db_pool_max_size,
+            "max_inactive_connection_lifetime": Config.db_pool_max_inactive_lifetime,
+            "connection_class": ApprovalConnection,
+        }
+        self._pool: asyncpg.Pool | None = None
+        self._pool_lock = asyncio.Lock()
+        self.row_cache = RowCache(Config.row_cache_size, Config.row_cache_ttl)
+        self._listener_conn: asyncpg.Connection | None = None
+        self._listener_task: asyncio.Task | None = None
 
-    async def __aenter__(self) -> "ApprovalDB":
+    async def get_pool(self) -> asyncpg.Pool:
         """
-        Устанавливает соединение с базой данных при входе в контекстный менеджер.
+        Возвращает пул соединений с базой данных, создавая его при первом вызове.
 
-        :return: Объект ApprovalDB
+        :return: Пул соединений asyncpg
         :raises Exception: При ошибке подключения
         """
 
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    try:
+                        self._pool = await asyncpg.create_pool(
+                            **self.db_params, **self.pool_params
+                        )
+                        logger.info("Пул соединений с PostgreSQL создан.")
+                    except Exception as e:
+                        logger.error(f"Ошибка при подключении к базе данных: {e}")
+                        raise
+        return self._pool
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        """
+        Выдает соединение из пула на время одной операции и возвращает его обратно.
+
+        :return: Соединение asyncpg
+        """
+
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            yield conn
+
+    @staticmethod
+    async def statement(
+        conn: ApprovalConnection, name: str, query: str | None = None
+    ) -> asyncpg.prepared_stmt.PreparedStatement:
+        """
+        Возвращает подготовленный запрос из каталога, подготавливая его
+        на данном соединении только при первом обращении.
+
+        :param conn: Соединение из пула
+        :param name: Имя запроса в каталоге STATEMENTS
+        :param query: Текст запроса, если его нет в каталоге STATEMENTS
+        :return: Подготовленный запрос
+        """
+
+        prepared = conn.prepared_statements.get(name)
+        if prepared is None:
+            prepared = await conn.prepare(query or STATEMENTS[name])
+            conn.prepared_statements[name] = prepared
+        return prepared
+
+    async def startup(self) -> None:
+        """
+        Подготавливает базу данных к работе при запуске бота:
+        создает пул соединений и применяет миграции схемы.
+
+        :return: None
+        """
+
+        pool = await self.get_pool()
+        await self.migrate()
+        await self.start_listener()
+        logger.info(f"База данных готова, соединений в пуле: {pool.get_size()}.")
+
+    async def start_listener(self) -> None:
+        """
+        Подписывается на канал 'hr_approvals_changed' отдельным соединением,
+        чтобы инвалидировать кэш строк при изменении строк любой репликой или вручную.
+
+        :return: None
+        """
+
         try:
-            self._conn = await asyncpg.connect(**self.db_params)
-            logger.info("Соединение с PostgreSQL установлено.")
-            return self
+            self._listener_conn = await asyncpg.connect(**self.db_params)
+            await self._listener_conn.add_listener(
+                CHANGES_CHANNEL, self._on_row_changed
+            )
+            self._listener_conn.add_termination_listener(self._on_listener_terminated)
+            self.row_cache.enabled = True
+            logger.info(f"Подписка на канал {CHANGES_CHANNEL} установлена.")
         except Exception as e:
-            logger.error(f"Ошибка при подключении к базе данных: {e}")
-            raise
+            # без подписки кэш может отдавать устаревшие данные - отключаем его
+            self._listener_conn = None
+            self.row_cache.enabled = False
+            self.row_cache.clear()
+            logger.error(f"Не удалось подписаться на канал {CHANGES_CHANNEL}: {e}")
+            self._schedule_listener_restart()
+
+    def _on_row_changed(
+        self, conn: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        """
+        Инвалидирует строку кэша по уведомлению из базы данных.
+
+        :param conn: Соединение, получившее уведомление
+        :param pid: PID процесса базы данных, отправившего уведомление
+        :param channel: Имя канала
+        :param payload: ID измененной строки
+        """
+
+        self.row_cache.invalidate(int(payload))
+
+    def _on_listener_terminated(self, conn: asyncpg.Connection) -> None:
+        """
+        Очищает кэш и переподключает подписку после разрыва соединения:
+        уведомления за время разрыва потеряны.
 
-    async def __aexit__(self, exc_type: any, exc_val: any, exc_tb: any) -> bool:
+        :param conn: Разорванное соединение
         """
-        Закрывает соединение с базой данных при выходе из контекстного менеджера.
 
-        :param exc_type: Тип исключения (если возникло)
-        :param exc_val: Значение исключения (если возникло)
-        :param exc_tb: Трейсбэк исключения (если возникло)
-        :return: True, если обработка завершена успешно
+        if self._listener_conn is not conn:
+            return
+        logger.warning(f"Соединение подписки на канал {CHANGES_CHANNEL} разорвано.")
+        self._listener_conn = None
+        self.row_cache.enabled = False
+        self.row_cache.clear()
+        self._schedule_listener_restart()
+
+    def _schedule_listener_restart(self) -> None:
+        """Запускает повторную подписку на уведомления с задержкой."""
+
+        async def restart() -> None:
+            await asyncio.sleep(LISTENER_RETRY_DELAY)
+            self._listener_task = None
+            await self.start_listener()
+
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(restart())
+
+    async def close(self) -> None:
         """
+        Закрывает подписку на уведомления и пул соединений с базой данных.
 
-        if exc_type:
-            logger.error(f"Произошла ошибка: {exc_type}; {exc_val}; {exc_tb}")
-        if self._conn:
-            await self._conn.close()
-            logger.info("Соединение с PostgreSQL разъединено.")
-        return True
+        :return: None
+        """
 
-    async def create_table(self) -> None:
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            self._listener_task = None
+        if self._listener_conn is not None:
+            conn, self._listener_conn = self._listener_conn, None
+            await conn.close()
+        self.row_cache.enabled = False
+        self.row_cache.clear()
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            logger.info("Пул соединений с PostgreSQL закрыт.")
+
+    async def migrate(self) -> None:
         """
-        Создает таблицу 'hr_approvals', если она еще не существует.
+        Применяет к базе данных все непримененные миграции схемы.
 
         :return: None
         """
 
-        async with self:
-            query = """
-            CREATE TABLE IF NOT EXISTS hr_approvals (
-                id SERIAL PRIMARY KEY,
-                amount REAL,
-                item TEXT,
-                groupment TEXT,
-                comment TEXT,
-                period TEXT,
-                payment_method TEXT,
-                approvals_needed INTEGER,
-                approvals_received INTEGER,
-                status TEXT,
-                approved_by TEXT,
-                initiator_id INTEGER
-            )
-            """
-            try:
-                await self._conn.execute(query)
-                logger.info('Таблица "hr_approvals" создана или уже существует.')
-            except Exception as e:
-                logger.error(f"Ошибка при создании таблицы: {e}")
-                raise
+        async with self.acquire() as conn:
+            await run_migrations(conn)
 
     async def insert_record(self, record_dict: dict[str, any]) -> int:
         """
@@ -95,36 +237,93 @@ class ApprovalDB:
         :raises RuntimeError: При ошибке добавления
         """
 
-        query = """
-        INSERT INTO hr_approvals (
-            amount, item, groupment,
-            comment, period, payment_method, approvals_needed,
-            approvals_received, status, approved_by, initiator_id
-        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-        RETURNING id
-        """
         try:
-            row_id = await self._conn.fetchval(query, *record_dict.values())
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, "insert_record")
+                row_id = await statement.fetchval(
+                    *(record_dict[column] for column in INSERT_COLUMNS),
+                    await get_nickname("initiator", record_dict["initiator_id"]),
+                )
             logger.info("Информация о счёте успешно добавлена.")
             return row_id
         except Exception as e:
             logger.error(f"Не удалось добавить информацию о счёте: {e}")
             raise RuntimeError(f"Ошибка при добавлении информации о счете: {e}")
 
+    async def insert_records(self, records: Iterable[dict[str, any]]) -> list[int]:
+        """
+        Добавляет пачку записей в таблицу 'hr_approvals' через COPY в одной транзакции.
+
+        ID записей заранее резервируются в последовательности одним запросом,
+        поэтому порядок возвращаемых ID совпадает с порядком входных записей.
+        События создания счетов записываются в журнал в той же транзакции.
+
+        :param records: Итерируемый объект со словарями данных для добавления
+        :return: Список ID созданных записей в порядке входных данных
+        :raises RuntimeError: При ошибке добавления
+        """
+
+        records = list(records)
+        if not records:
+            return []
+
+        try:
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    statement = await self.statement(conn, "reserve_ids")
+                    row_ids = sorted(
+                        row["id"] for row in await statement.fetch(len(records))
+                    )
+                    await conn.copy_records_to_table(
+                        "hr_approvals",
+                        records=(
+                            (row_id, *(record[column] for column in INSERT_COLUMNS))
+                            for row_id, record in zip(row_ids, records)
+                        ),
+                        columns=("id", *INSERT_COLUMNS),
+                    )
+                    events = [
+                        (
+                            row_id,
+                            await get_nickname("initiator", record["initiator_id"]),
+                            "initiator",
+                            None,
+                            record["status"],
+                        )
+                        for row_id, record in zip(row_ids, records)
+                    ]
+                    await conn.copy_records_to_table(
+                        "hr_approval_events", records=events, columns=EVENT_COLUMNS
+                    )
+            logger.info(f"Добавлено {len(row_ids)} счетов.")
+            return row_ids
+        except Exception as e:
+            logger.error(f"Не удалось добавить пачку счетов: {e}")
+            raise RuntimeError(f"Ошибка при добавлении пачки счетов: {e}")
+
     async def get_row_by_id(self, row_id: int) -> dict[str, any] | None:
         """
         Возвращает словарь из названий и значений столбцов по id.
+        Строка читается из кэша, при промахе - из базы данных.
 
         :param row_id: ID записи для получения
         :return: Словарь с данными или None, если данные не найдены
         """
 
-        query = "SELECT * FROM hr_approvals WHERE id = $1"
+        record_dict = self.row_cache.get(row_id)
+        if record_dict is not None:
+            return record_dict
+
+        generation = self.row_cache.generation
         try:
-            row = await self._conn.fetchrow(query, row_id)
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, "get_row_by_id")
+                row = await statement.fetchrow(row_id)
             if row:
                 logger.info("Данные строки получены успешно.")
-                return dict(row)
+                record_dict = dict(row)
+                self.row_cache.put(row_id, record_dict, generation)
+                return record_dict
             return None
         except Exception as e:
             logger.error(f"Ошибка при получении строки по ID: {e}")
@@ -137,11 +336,14 @@ class ApprovalDB:
         :param column_name: Имя столбца для получения значения
         :param row_id: ID записи для получения значения
         :return: Значение столбца
+        :raises ValueError: Если столбец не входит в белый список
         """
 
-        query = f"SELECT {column_name} FROM hr_approvals WHERE id = $1"
+        name, query = get_value_statement(column_name)
         try:
-            value = await self._conn.fetchval(query, row_id)
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, name, query)
+                value = await statement.fetchval(row_id)
             logger.info(f"Значение получено успешно: {value}.")
             return value
         except Exception as e:
@@ -154,63 +356,346 @@ class ApprovalDB:
 
         :param row_id: ID записи для обновления
         :param updates: Словарь с новыми значениями для обновления
+        :raises ValueError: Если столбец не входит в белый список
         :raises Exception: При ошибке обновления
         """
 
-        set_clause = ", ".join(f"{key} = ${i + 1}" for i, key in enumerate(updates))
-        values = list(updates.values()) + [row_id]
-        query = f"UPDATE hr_approvals SET {set_clause} WHERE id = ${len(values)}"
+        name, query = update_statement(list(updates))
+        values = [updates[column] for column in sorted(updates)] + [row_id]
         try:
-            await self._conn.execute(query, *values)
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, name, query)
+                await statement.fetch(*values)
+            self.row_cache.invalidate(row_id)
             logger.info("Успешное обновление информации о счёте.")
         except Exception as e:
             logger.error(f"Ошибка при обновлении информации о счёте: {e}")
             raise
 
-    async def get_record_info(self, row_id: int) -> str:
+    async def transition_status(
+        self,
+        row_id: int,
+        expected_status: str | tuple[str, ...],
+        status: str,
+        approved_by: str | None = None,
+        approvals_received: int | None = None,
+        actor: str | None = None,
+        department: str | None = None,
+    ) -> dict[str, any] | None:
         """
-        Возвращает детали конкретного счета из базы данных и форматирует их для бота.
+        Атомарно переводит счёт в новый статус одним запросом.
 
-        :param row_id: ID счета для получения информации
-        :return: Форматированная строка с информацией о счете
+        Новый согласующий дописывается к 'approved_by' на стороне базы данных,
+        а обновление применяется только если текущий статус совпадает с ожидаемым.
+        Событие перехода записывается в журнал hr_approval_events тем же запросом.
+
+        :param row_id: ID записи для обновления
+        :param expected_status: Ожидаемый текущий статус или кортеж допустимых статусов
+        :param status: Новый статус
+        :param approved_by: Согласующий, которого нужно добавить в 'approved_by'
+        :param approvals_received: Новое количество согласований
+        :param actor: Сотрудник, выполнивший переход
+        :param department: Департамент сотрудника
+        :return: Словарь с обновлёнными данными или None, если переход не применён
         """
 
-        record_dict = await self.get_row_by_id(row_id)
-        if not record_dict:
-            return "Данные по указанному ID не найдены."
+        if isinstance(expected_status, str):
+            expected_status = (expected_status,)
+
+        generation = self.row_cache.generation
+        try:
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, "transition_status")
+                row = await statement.fetchrow(
+                    row_id,
+                    status,
+                    approved_by,
+                    approvals_received,
+                    list(expected_status),
+                    actor,
+                    department,
+                )
+        except Exception as e:
+            logger.error(f"Ошибка при изменении статуса счёта: {e}")
+            raise
 
-        initiator_nickname = await get_nickname(
-            "initiator", record_dict["initiator_id"]
+        if row is None:
+            logger.info(
+                f"Статус счёта №{row_id} не изменён: ожидался статус {expected_status}."
+            )
+            return None
+
+        logger.info(f"Статус счёта №{row_id} изменён на {status}.")
+        record_dict = dict(row)
+        self.row_cache.put(
+            row_id,
+            {k: v for k, v in record_dict.items() if k != "from_status"},
+            generation,
         )
+        return record_dict
+
+    async def claim_outbox(self, limit: int, lease: float) -> list[dict[str, any]]:
+        """
+        Захватывает записи очереди sheets_outbox, готовые к отправке в Google Sheets.
+
+        Захваченные записи не выдаются другим обработчикам в течение lease секунд,
+        после чего будут выданы повторно, если их не подтвердили.
+
+        :param limit: Максимальное количество записей
+        :param lease: Время аренды записей в секундах
+        :return: Список словарей с данными счетов и полями outbox_id, outbox_attempts
+            и outbox_range (диапазон, в котором нужно искать строки счёта перед записью)
+        """
+
+        try:
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, "claim_outbox")
+                result = await statement.fetch(limit, lease)
+            return sorted((dict(row) for row in result), key=lambda r: r["outbox_id"])
+        except Exception as e:
+            logger.error(f"Ошибка при получении записей очереди Google Sheets: {e}")
+            raise
+
+    async def complete_outbox(
+        self, outbox_ids: list[int], sheet_ranges: list[str | None]
+    ) -> None:
+        """
+        Отмечает записи очереди sheets_outbox как успешно отправленные.
+
+        :param outbox_ids: ID записей очереди
+        :param sheet_ranges: Диапазоны строк счетов в таблице в нотации A1, в том же порядке
+        """
+
+        async with self.acquire() as conn:
+            statement = await self.statement(conn, "complete_outbox")
+            await statement.fetch(outbox_ids, sheet_ranges)
+
+    async def fail_outbox(
+        self,
+        outbox_id: int,
+        error: str,
+        max_attempts: int,
+        retry_delay: float,
+        sheet_range: str | None = None,
+    ) -> str:
+        """
+        Фиксирует неудачную попытку отправки записи очереди sheets_outbox.
+
+        :param outbox_id: ID записи очереди
+        :param error: Текст ошибки
+        :param max_attempts: Количество попыток, после которого запись переводится в 'dead'
+        :param retry_delay: Задержка перед следующей попыткой в секундах
+        :param sheet_range: Диапазон, в котором могли оказаться строки неудачной записи;
+            сохраняется, только если у записи еще нет диапазона
+        :return: Новый статус записи ('pending' или 'dead')
+        """
+
+        async with self.acquire() as conn:
+            statement = await self.statement(conn, "fail_outbox")
+            return await statement.fetchval(
+                outbox_id, error, max_attempts, retry_delay, sheet_range
+            )
+
+    async def get_last_sheet_range(self) -> str | None:
+        """
+        Возвращает диапазон последней записанной в Google Sheets записи очереди sheets_outbox.
+
+        :return: Диапазон в нотации A1 или None, если записей еще не было
+        """
+
+        async with self.acquire() as conn:
+            statement = await self.statement(conn, "get_last_sheet_range")
+            return await statement.fetchval()
+
+    async def get_reconciliation_cursor(self) -> tuple[int, list[int]]:
+        """
+        Возвращает курсор сверки с Google Sheets.
+
+        :return: ID последнего сверенного события оплаты журнала hr_approval_events
+            и ID счетов, которые нужно сверить повторно
+        """
+
+        async with self.acquire() as conn:
+            statement = await self.statement(conn, "get_reconciliation_cursor")
+            row = await statement.fetchrow()
+        return row["last_event_id"], list(row["recheck_row_ids"])
+
+    async def set_reconciliation_cursor(
+        self, event_id: int, recheck_row_ids: list[int]
+    ) -> None:
+        """
+        Сохраняет курсор сверки с Google Sheets.
+
+        :param event_id: ID последнего сверенного события оплаты журнала hr_approval_events
+        :param recheck_row_ids: ID счетов, которые нужно сверить повторно
+        """
+
+        async with self.acquire() as conn:
+            statement = await self.statement(conn, "set_reconciliation_cursor")
+            await statement.fetch(event_id, recheck_row_ids)
+
+    async def find_paid_since(
+        self, event_id: int, limit: int, grace: float
+    ) -> list[dict[str, any]]:
+        """
+        Возвращает оплаты, записанные в журнал после указанного события,
+        вместе с состоянием последней записи очереди sheets_outbox по счёту.
+
+        :param event_id: ID последнего сверенного события
+        :param limit: Максимальное количество оплат
+        :param grace: Минимальный возраст оплаты в секундах
+        :return: Список словарей с данными счетов и полями event_id, outbox_status, sheet_range
+        """
+
+        try:
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, "find_paid_since")
+                result = await statement.fetch(event_id, limit, grace)
+            return [dict(row) for row in result]
+        except Exception as e:
+            logger.error(f"Ошибка при получении оплат для сверки: {e}")
+            raise
+
+    async def find_paid_by_ids(self, row_ids: list[int]) -> list[dict[str, any]]:
+        """
+        Возвращает оплаченные счета по ID вместе с состоянием
+        последней записи очереди sheets_outbox по счёту.
+
+        :param row_ids: ID счетов
+        :return: Список словарей с данными счетов и полями outbox_status, sheet_range
+        """
+
+        try:
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, "find_paid_by_ids")
+                result = await statement.fetch(row_ids)
+            return [dict(row) for row in result]
+        except Exception as e:
+            logger.error(f"Ошибка при получении оплат для повторной сверки: {e}")
+            raise
+
+    async def requeue_outbox(self, row_ids: list[int]) -> None:
+        """
+        Повторно ставит счета в очередь записи в Google Sheets.
+        Новая запись очереди получает диапазон предыдущей записи по счёту.
+
+        :param row_ids: ID счетов
+        """
+
+        async with self.acquire() as conn:
+            statement = await self.statement(conn, "requeue_outbox")
+            await statement.fetch(row_ids)
+
+    async def get_message_state(self, row_id: int) -> str | None:
+        """
+        Возвращает сохраненное состояние сообщений по счёту.
+
+        :param row_id: ID счёта
+        :return: Состояние в формате JSON или None, если оно не сохранялось
+        """
+
+        async with self.acquire() as conn:
+            statement = await self.statement(conn, "get_message_state")
+            return await statement.fetchval(row_id)
+
+    async def save_message_states(
+        self, states: dict[int, str], deleted: list[int]
+    ) -> None:
+        """
+        Сохраняет состояния сообщений по счетам и удаляет ненужные одной транзакцией.
+
+        :param states: Состояния в формате JSON по ID счетов
+        :param deleted: ID счетов, состояния которых нужно удалить
+        """
+
+        try:
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    if states:
+                        statement = await self.statement(conn, "save_message_states")
+                        await statement.fetch(list(states), list(states.values()))
+                    if deleted:
+                        statement = await self.statement(conn, "delete_message_states")
+                        await statement.fetch(deleted)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояния сообщений: {e}")
+            raise
+
+    async def get_events(self, row_id: int) -> list[dict[str, any]]:
+        """
+        Возвращает историю изменений статуса счёта в хронологическом порядке.
+
+        :param row_id: ID счёта
+        :return: Список словарей с событиями журнала
+        """
+
+        try:
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, "get_events")
+                result = await statement.fetch(row_id)
+            return [dict(row) for row in result]
+        except Exception as e:
+            logger.error(f"Ошибка при получении истории счёта: {e}")
+            raise
+
+    @staticmethod
+    def format_record_info(record_dict: dict[str, any], initiator_nickname: str) -> str:
+        """
+        Форматирует данные счета для отправки ботом.
+
+        :param record_dict: Словарь с данными счета
+        :param initiator_nickname: Nickname инициатора счёта
+        :return: Форматированная строка с информацией о счете
+        """
+
+        period = ", ".join(month.strftime("%d.%m.%Y") for month in record_dict["period"])
         return (
-            f"<b>ID счёта: {row_id}</b>\n"
+            f'<b>ID счёта: {record_dict["id"]}</b>\n'
             f"Данные счета:\n"
             f'1. Сумма: {record_dict["amount"]}₽\n'
             f'2. Статья: "{record_dict["item"]}"\n'
             f'3. Группа: "{record_dict["groupment"]}"\n'
             f'4. Комментарий: "{record_dict["comment"]}"\n'
-            f'5. Даты начисления: "{", ".join(record_dict["period"].split())}"\n'
+            f'5. Даты начисления: "{period}"\n'
             f'6. Форма оплаты: "{record_dict["payment_method"]}"\n'
             f'7. Инициатор счёта: "{initiator_nickname}"\n'
         )
 
-    async def find_not_paid(self) -> list[int]:
+    async def find_not_paid_page(
+        self,
+        limit: int,
+        after_id: int | None = None,
+        before_id: int | None = None,
+    ) -> tuple[list[dict[str, any]], bool]:
         """
-        Возвращает список ID ячеек для неоплаченных счетов.
+        Возвращает страницу неоплаченных счетов с пагинацией по ключу id.
+
+        Без before_id возвращает счета с id больше after_id, с before_id - счета
+        с id меньше before_id. Страница всегда упорядочена по возрастанию id.
 
-        :return: Список ID ячеек неоплаченных счетов
+        :param limit: Количество счетов на странице
+        :param after_id: ID, после которого начинается страница
+        :param before_id: ID, перед которым заканчивается страница
+        :return: Кортеж из списка словарей с данными счетов и флага наличия
+            следующих записей в направлении выборки
         """
 
-        query = "SELECT id FROM hr_approvals WHERE status NOT IN ($1, $2)"
+        if before_id is not None:
+            name, key = "find_not_paid_prev_page", before_id
+        else:
+            name, key = "find_not_paid_next_page", after_id or 0
+
         try:
-            result = await self._conn.fetch(query, "Paid", "Rejected")
-            ids = [row["id"] for row in result]
-            logger.info(
-                f"Найдено {len(ids)} неоплаченных счетов."
-                if ids
-                else "Неоплаченных счетов не найдено."
-            )
-            return ids
+            async with self.acquire() as conn:
+                statement = await self.statement(conn, name)
+                result = await statement.fetch(key, limit + 1)
         except Exception as e:
             logger.error(f"Ошибка при поиске неоплаченных счетов: {e}")
             raise
+
+        has_more = len(result) > limit
+        records = [dict(row) for row in result[:limit]]
+        if before_id is not None:
+            records.reverse()
+        logger.info(f"Получена страница из {len(records)} неоплаченных счетов.")
+        return records, has_more
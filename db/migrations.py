@@ -0,0 +1,297 @@
+from typing import Awaitable, Callable
+
+import asyncpg
+
+from config.config import Config
+from helper.logging_config import logger
+
+# ключ advisory-блокировки, чтобы несколько реплик не применяли миграции одновременно
+MIGRATIONS_LOCK_KEY = 7_345_120_001
+
+
+class Migration:
+    """Версионированная миграция схемы базы данных"""
+
+    def __init__(
+        self,
+        version: int,
+        description: str,
+        up: str,
+        prepare: str | None = None,
+        backfill: Callable[[asyncpg.Connection, int], Awaitable[None]] | None = None,
+    ):
+        """
+        Инициализирует объект Migration.
+
+        :param version: Номер версии схемы
+        :param description: Описание миграции
+        :param up: SQL, выполняемый в одной транзакции с записью номера версии
+        :param prepare: Идемпотентный SQL, выполняемый перед переносом данных
+        :param backfill: Функция пакетного переноса существующих строк
+        """
+
+        self.version = version
+        self.description = description
+        self.up = up
+        self.prepare = prepare
+        self.backfill = backfill
+
+
+TYPED_COLUMNS_ASSIGNMENT = """
+    amount_numeric = amount::NUMERIC(14, 2),
+    status_typed = COALESCE(status, 'Not processed')::approval_status,
+    period_dates = ARRAY(
+        SELECT to_date(month, 'DD.MM.YYYY')
+        FROM unnest(string_to_array(trim(period), ' ')) WITH ORDINALITY AS p(month, n)
+        WHERE month <> ''
+        ORDER BY n
+    ),
+    initiator_id_bigint = initiator_id
+"""
+
+
+async def backfill_typed_columns(conn: asyncpg.Connection, batch_size: int) -> None:
+    """
+    Пакетно переносит данные hr_approvals в типизированные столбцы.
+
+    Каждый пакет выполняется в отдельной транзакции, поэтому перенос
+    не блокирует таблицу целиком и может быть продолжен после сбоя.
+
+    :param conn: Соединение с базой данных
+    :param batch_size: Количество строк в одном пакете
+    """
+
+    query = f"""
+    UPDATE hr_approvals
+    SET {TYPED_COLUMNS_ASSIGNMENT}
+    WHERE id IN (
+        SELECT id FROM hr_approvals
+        WHERE status_typed IS NULL
+        ORDER BY id
+        LIMIT $1
+    )
+    """
+    total = 0
+    while True:
+        async with conn.transaction():
+            result = await conn.execute(query, batch_size)
+        updated = int(result.split()[-1])
+        if not updated:
+            break
+        total += updated
+        logger.info(f"Перенесено {total} строк в типизированные столбцы.")
+
+
+MIGRATIONS = [
+    Migration(
+        version=1,
+        description="Создание таблицы hr_approvals",
+        up="""
+        CREATE TABLE IF NOT EXISTS hr_approvals (
+            id SERIAL PRIMARY KEY,
+            amount REAL,
+            item TEXT,
+            groupment TEXT,
+            comment TEXT,
+            period TEXT,
+            payment_method TEXT,
+            approvals_needed INTEGER,
+            approvals_received INTEGER,
+            status TEXT,
+            approved_by TEXT,
+            initiator_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS hr_approvals_not_paid_idx
+        ON hr_approvals (id)
+        WHERE status NOT IN ('Paid', 'Rejected');
+        """,
+    ),
+    Migration(
+        version=2,
+        description="Типизированные столбцы amount, status, period и initiator_id",
+        prepare="""
+        DO $$ BEGIN
+            CREATE TYPE approval_status AS ENUM (
+                'Not processed', 'Pending', 'Approved', 'Paid', 'Rejected'
+            );
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$;
+        ALTER TABLE hr_approvals
+            ADD COLUMN IF NOT EXISTS amount_numeric NUMERIC(14, 2),
+            ADD COLUMN IF NOT EXISTS status_typed approval_status,
+            ADD COLUMN IF NOT EXISTS period_dates DATE[],
+            ADD COLUMN IF NOT EXISTS initiator_id_bigint BIGINT;
+        """,
+        backfill=backfill_typed_columns,
+        up=f"""
+        UPDATE hr_approvals SET {TYPED_COLUMNS_ASSIGNMENT} WHERE status_typed IS NULL;
+        DROP INDEX IF EXISTS hr_approvals_not_paid_idx;
+        ALTER TABLE hr_approvals
+            DROP COLUMN amount,
+            DROP COLUMN status,
+            DROP COLUMN period,
+            DROP COLUMN initiator_id;
+        ALTER TABLE hr_approvals RENAME COLUMN amount_numeric TO amount;
+        ALTER TABLE hr_approvals RENAME COLUMN status_typed TO status;
+        ALTER TABLE hr_approvals RENAME COLUMN period_dates TO period;
+        ALTER TABLE hr_approvals RENAME COLUMN initiator_id_bigint TO initiator_id;
+        ALTER TABLE hr_approvals
+            ALTER COLUMN status SET DEFAULT 'Not processed',
+            ALTER COLUMN status SET NOT NULL;
+        CREATE INDEX hr_approvals_not_paid_idx
+        ON hr_approvals (id)
+        WHERE status NOT IN ('Paid', 'Rejected');
+        CREATE INDEX hr_approvals_period_idx ON hr_approvals USING GIN (period);
+        CREATE INDEX hr_approvals_initiator_id_idx ON hr_approvals (initiator_id);
+        """,
+    ),
+    Migration(
+        version=3,
+        description="Журнал изменений статусов hr_approval_events",
+        up="""
+        CREATE TABLE hr_approval_events (
+            id BIGSERIAL PRIMARY KEY,
+            row_id INTEGER NOT NULL REFERENCES hr_approvals (id) ON DELETE CASCADE,
+            actor TEXT,
+            department TEXT,
+            from_status approval_status,
+            to_status approval_status NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX hr_approval_events_row_id_idx
+        ON hr_approval_events (row_id, created_at, id);
+        """,
+    ),
+    Migration(
+        version=4,
+        description="Уведомления об изменении строк hr_approvals",
+        up="""
+        CREATE OR REPLACE FUNCTION notify_hr_approvals_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('hr_approvals_changed', OLD.id::text);
+            ELSE
+                PERFORM pg_notify('hr_approvals_changed', NEW.id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        CREATE TRIGGER hr_approvals_changed
+        AFTER UPDATE OR DELETE ON hr_approvals
+        FOR EACH ROW EXECUTE FUNCTION notify_hr_approvals_changed();
+        """,
+    ),
+    Migration(
+        version=5,
+        description="Очередь записи оплаченных счетов в Google Sheets",
+        up="""
+        CREATE TYPE outbox_status AS ENUM ('pending', 'done', 'dead');
+        CREATE TABLE sheets_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            row_id INTEGER NOT NULL REFERENCES hr_approvals (id) ON DELETE CASCADE,
+            status outbox_status NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX sheets_outbox_pending_idx
+        ON sheets_outbox (next_attempt_at)
+        WHERE status = 'pending';
+        """,
+    ),
+    Migration(
+        version=6,
+        description="Сверка оплаченных счетов с таблицей Google Sheets",
+        up="""
+        ALTER TABLE sheets_outbox ADD COLUMN sheet_range TEXT;
+        CREATE INDEX sheets_outbox_row_id_idx ON sheets_outbox (row_id, id);
+        CREATE INDEX hr_approval_events_paid_idx
+        ON hr_approval_events (id)
+        WHERE to_status = 'Paid';
+        CREATE TABLE sheets_reconciliation (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            last_event_id BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        -- оплаты, записанные в таблицу до появления очереди, не сверяются
+        INSERT INTO sheets_reconciliation (last_event_id)
+        SELECT COALESCE(max(e.id), 0)
+        FROM hr_approval_events AS e
+        WHERE e.to_status = 'Paid'
+            AND NOT EXISTS (SELECT 1 FROM sheets_outbox AS o WHERE o.row_id = e.row_id);
+        """,
+    ),
+    Migration(
+        version=7,
+        description="Состояние отправленных по счетам сообщений",
+        up="""
+        CREATE TABLE message_state (
+            row_id INTEGER PRIMARY KEY REFERENCES hr_approvals (id) ON DELETE CASCADE,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+    ),
+    Migration(
+        version=8,
+        description="Счета, которые нужно сверить повторно",
+        up="""
+        ALTER TABLE sheets_reconciliation
+        ADD COLUMN recheck_row_ids INTEGER[] NOT NULL DEFAULT '{}';
+        """,
+    ),
+]
+
+
+async def run_migrations(conn: asyncpg.Connection) -> None:
+    """
+    Применяет к базе данных все ещё не применённые миграции по порядку версий.
+
+    :param conn: Соединение с базой данных
+    :raises Exception: При ошибке применения миграции
+    """
+
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+    try:
+        applied = {
+            row["version"]
+            for row in await conn.fetch("SELECT version FROM schema_migrations")
+        }
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+
+            logger.info(
+                f"Применение миграции {migration.version}: {migration.description}."
+            )
+            try:
+                if migration.prepare:
+                    async with conn.transaction():
+                        await conn.execute(migration.prepare)
+                if migration.backfill:
+                    await migration.backfill(conn, Config.db_migration_batch_size)
+                async with conn.transaction():
+                    await conn.execute(migration.up)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                        migration.version,
+                        migration.description,
+                    )
+            except Exception as e:
+                logger.error(f"Ошибка при применении миграции {migration.version}: {e}")
+                raise
+
+        logger.info("Схема базы данных в актуальном состоянии.")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
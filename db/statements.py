@@ -0,0 +1,266 @@
+# Каталог именованных запросов к hr_approvals.
+# Каждый запрос подготавливается один раз на соединение пула (см. ApprovalDB.statement),
+# поэтому текст запросов должен оставаться неизменным.
+
+# столбцы hr_approvals, которые разрешено читать и изменять по имени
+COLUMNS = frozenset(
+    {
+        "amount",
+        "item",
+        "groupment",
+        "comment",
+        "period",
+        "payment_method",
+        "approvals_needed",
+        "approvals_received",
+        "status",
+        "approved_by",
+        "initiator_id",
+    }
+)
+
+# порядок столбцов в запросе insert_record (после них передается инициатор для журнала)
+INSERT_COLUMNS = (
+    "amount",
+    "item",
+    "groupment",
+    "comment",
+    "period",
+    "payment_method",
+    "approvals_needed",
+    "approvals_received",
+    "status",
+    "approved_by",
+    "initiator_id",
+)
+
+# столбцы журнала событий, заполняемые при пакетной записи
+EVENT_COLUMNS = ("row_id", "actor", "department", "from_status", "to_status")
+
+# столбцы, необходимые для отображения счёта
+DISPLAY_COLUMNS = (
+    "id, amount, item, groupment, comment, period, payment_method, initiator_id"
+)
+
+STATEMENTS = {
+    # вместе со счётом в журнал записывается событие его создания
+    "insert_record": f"""
+        WITH inserted AS (
+            INSERT INTO hr_approvals ({", ".join(INSERT_COLUMNS)})
+            VALUES ({", ".join(f"${i}" for i in range(1, len(INSERT_COLUMNS) + 1))})
+            RETURNING id, status
+        )
+        INSERT INTO hr_approval_events (row_id, actor, department, to_status)
+        SELECT id, ${len(INSERT_COLUMNS) + 1}, 'initiator', status FROM inserted
+        RETURNING row_id AS id
+    """,
+    "reserve_ids": """
+        SELECT nextval(pg_get_serial_sequence('hr_approvals', 'id')) AS id
+        FROM generate_series(1, $1)
+    """,
+    "get_row_by_id": "SELECT * FROM hr_approvals WHERE id = $1",
+    # переход статуса, запись события в журнал и постановка оплаченного счёта
+    # в очередь записи в Google Sheets выполняются одним запросом
+    "transition_status": """
+        WITH previous AS (
+            SELECT id, status FROM hr_approvals
+            WHERE id = $1 AND status = ANY($5::approval_status[])
+            FOR UPDATE
+        ),
+        updated AS (
+            UPDATE hr_approvals AS h
+            SET status = $2,
+                approved_by = CASE
+                    WHEN $3::text IS NULL THEN h.approved_by
+                    WHEN h.approved_by IS NULL OR h.approved_by = '' THEN $3::text
+                    ELSE h.approved_by || ' и ' || $3::text
+                END,
+                approvals_received = COALESCE($4::integer, h.approvals_received)
+            FROM previous
+            WHERE h.id = previous.id
+            RETURNING h.*, previous.status AS from_status
+        ),
+        event AS (
+            INSERT INTO hr_approval_events (row_id, actor, department, from_status, to_status)
+            SELECT id, $6, $7, from_status, status FROM updated
+        ),
+        outbox AS (
+            INSERT INTO sheets_outbox (row_id)
+            SELECT id FROM updated WHERE status = 'Paid'
+        )
+        SELECT * FROM updated
+    """,
+    # захват готовых к отправке записей очереди: до истечения аренды ($2 секунд)
+    # их не возьмет другой обработчик
+    "claim_outbox": """
+        UPDATE sheets_outbox AS o
+        SET next_attempt_at = now() + make_interval(secs => $2::double precision)
+        FROM hr_approvals AS h
+        WHERE o.id IN (
+            SELECT id FROM sheets_outbox
+            WHERE status = 'pending' AND next_attempt_at <= now()
+            ORDER BY id
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        AND h.id = o.row_id
+        RETURNING o.id AS outbox_id, o.attempts AS outbox_attempts,
+            o.sheet_range AS outbox_range, h.*
+    """,
+    # вместе с отметкой об отправке сохраняется диапазон строк счёта в таблице
+    "complete_outbox": """
+        UPDATE sheets_outbox AS o
+        SET status = 'done',
+            attempts = o.attempts + 1,
+            last_error = NULL,
+            sheet_range = r.sheet_range,
+            updated_at = now()
+        FROM unnest($1::bigint[], $2::text[]) AS r(id, sheet_range)
+        WHERE o.id = r.id
+    """,
+    "fail_outbox": """
+        UPDATE sheets_outbox
+        SET attempts = attempts + 1,
+            last_error = $2,
+            status = CASE WHEN attempts + 1 >= $3 THEN 'dead' ELSE 'pending' END::outbox_status,
+            next_attempt_at = now() + make_interval(secs => $4::double precision),
+            sheet_range = COALESCE(sheet_range, $5),
+            updated_at = now()
+        WHERE id = $1
+        RETURNING status
+    """,
+    # последний записанный в таблицу диапазон: строки следующей записи окажутся ниже него
+    "get_last_sheet_range": """
+        SELECT sheet_range FROM sheets_outbox
+        WHERE status = 'done' AND sheet_range IS NOT NULL
+        ORDER BY id DESC
+        LIMIT 1
+    """,
+    "get_reconciliation_cursor": """
+        SELECT last_event_id, recheck_row_ids FROM sheets_reconciliation
+    """,
+    "set_reconciliation_cursor": """
+        UPDATE sheets_reconciliation
+        SET last_event_id = $1, recheck_row_ids = $2::integer[], updated_at = now()
+    """,
+    # оплаты после курсора сверки вместе с последней записью очереди по счёту;
+    # оплаты моложе $3 секунд пропускаются, чтобы не обогнать незавершенные транзакции
+    "find_paid_since": """
+        SELECT e.id AS event_id, o.status AS outbox_status, o.sheet_range, h.*
+        FROM hr_approval_events AS e
+        JOIN hr_approvals AS h ON h.id = e.row_id
+        LEFT JOIN LATERAL (
+            SELECT status, sheet_range FROM sheets_outbox
+            WHERE row_id = e.row_id
+            ORDER BY id DESC
+            LIMIT 1
+        ) AS o ON TRUE
+        WHERE e.to_status = 'Paid'
+            AND e.id > $1
+            AND e.created_at < now() - make_interval(secs => $3::double precision)
+        ORDER BY e.id
+        LIMIT $2
+    """,
+    # счета, отложенные предыдущими запусками сверки, с последней записью очереди по счёту
+    "find_paid_by_ids": """
+        SELECT o.status AS outbox_status, o.sheet_range, h.*
+        FROM hr_approvals AS h
+        LEFT JOIN LATERAL (
+            SELECT status, sheet_range FROM sheets_outbox
+            WHERE row_id = h.id
+            ORDER BY id DESC
+            LIMIT 1
+        ) AS o ON TRUE
+        WHERE h.id = ANY($1::integer[]) AND h.status = 'Paid'
+        ORDER BY h.id
+    """,
+    # повторная запись наследует диапазон предыдущей, чтобы перед записью
+    # проверить, нет ли уже строк счёта в таблице
+    "requeue_outbox": """
+        INSERT INTO sheets_outbox (row_id, sheet_range)
+        SELECT r.row_id, o.sheet_range
+        FROM unnest($1::integer[]) AS r(row_id)
+        LEFT JOIN LATERAL (
+            SELECT sheet_range FROM sheets_outbox
+            WHERE row_id = r.row_id
+            ORDER BY id DESC
+            LIMIT 1
+        ) AS o ON TRUE
+    """,
+    "get_message_state": "SELECT data::text FROM message_state WHERE row_id = $1",
+    "save_message_states": """
+        INSERT INTO message_state (row_id, data)
+        SELECT row_id, data::jsonb FROM unnest($1::integer[], $2::text[]) AS s(row_id, data)
+        ON CONFLICT (row_id) DO UPDATE SET data = EXCLUDED.data, updated_at = now()
+    """,
+    "delete_message_states": "DELETE FROM message_state WHERE row_id = ANY($1::integer[])",
+    "get_events": """
+        SELECT actor, department, from_status, to_status, created_at
+        FROM hr_approval_events
+        WHERE row_id = $1
+        ORDER BY created_at, id
+    """,
+    # условия совпадают с условием частичного индекса hr_approvals_not_paid_idx
+    "find_not_paid_next_page": f"""
+        SELECT {DISPLAY_COLUMNS} FROM hr_approvals
+        WHERE status NOT IN ('Paid', 'Rejected') AND id > $1
+        ORDER BY id
+        LIMIT $2
+    """,
+    "find_not_paid_prev_page": f"""
+        SELECT {DISPLAY_COLUMNS} FROM hr_approvals
+        WHERE status NOT IN ('Paid', 'Rejected') AND id < $1
+        ORDER BY id DESC
+        LIMIT $2
+    """,
+}
+
+
+def check_columns(columns) -> None:
+    """
+    Проверяет, что все имена столбцов входят в белый список COLUMNS.
+
+    :param columns: Имена столбцов
+    :raises ValueError: Если найден неизвестный столбец
+    """
+
+    unknown = set(columns) - COLUMNS
+    if unknown:
+        raise ValueError(f"Недопустимые столбцы hr_approvals: {', '.join(sorted(unknown))}")
+
+
+def get_value_statement(column_name: str) -> tuple[str, str]:
+    """
+    Возвращает имя и текст запроса для чтения одного столбца по ID.
+
+    :param column_name: Имя столбца из белого списка
+    :return: Кортеж из имени и текста запроса
+    :raises ValueError: Если столбец не входит в белый список
+    """
+
+    check_columns([column_name])
+    return (
+        f"get_value:{column_name}",
+        f"SELECT {column_name} FROM hr_approvals WHERE id = $1",
+    )
+
+
+def update_statement(columns: list[str]) -> tuple[str, str]:
+    """
+    Возвращает имя и текст запроса для обновления набора столбцов по ID.
+
+    Столбцы сортируются, поэтому один и тот же набор всегда дает один и тот же запрос.
+    Последним параметром запроса передается ID записи.
+
+    :param columns: Имена столбцов из белого списка
+    :return: Кортеж из имени и текста запроса
+    :raises ValueError: Если столбец не входит в белый список
+    """
+
+    check_columns(columns)
+    columns = sorted(columns)
+    set_clause = ", ".join(f"{column} = ${i + 1}" for i, column in enumerate(columns))
+    return (
+        f"update:{','.join(columns)}",
+        f"UPDATE hr_approvals SET {set_clause} WHERE id = ${len(columns) + 1}",
+    )
@@ -1,9 +1,246 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import OrderedDict
+
+from config.config import Config
 from db import db
 from helper.logging_config import logger
 from helper.messages import INITIATOR, HEAD, FINANCE, PAYMENT
+from helper.rate_limiter import TokenBucket
 from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 
+# приоритеты очереди исходящих запросов: меньше - раньше
+PRIORITY_APPROVAL = 0
+PRIORITY_NOTICE = 1
+
+# как часто из расписания чатов удаляются чаты, в которые уже можно отправлять
+CHAT_READY_PRUNE_INTERVAL = 60
+
+
+class OutboundRequest:
+    """Запрос к Telegram, ожидающий отправки в очереди TelegramScheduler"""
+
+    def __init__(self, func, chat_id: int | str, kwargs: dict):
+        """
+        Инициализирует объект OutboundRequest.
+
+        :param func: Метод бота, например context.bot.send_message
+        :param chat_id: ID чата
+        :param kwargs: Остальные аргументы метода
+        """
+
+        self.func = func
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.created_at = time.monotonic()
+        self.attempts = 0
+
+
+class TelegramScheduler:
+    """
+    Общая очередь исходящих запросов к Telegram.
+
+    Соблюдает общий лимит частоты запросов бота и интервал между запросами в один чат,
+    пропускает запросы на одобрение вперед уведомлений и повторяет запросы,
+    получившие RetryAfter, после указанной Telegram паузы.
+    """
+
+    def __init__(self):
+        """
+        Инициализирует объект TelegramScheduler.
+
+        Обработчик очереди запускается при первом запросе.
+        """
+
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._bucket = TokenBucket(Config.telegram_global_rate, Config.telegram_global_rate)
+        self._chat_ready_at: dict[int | str, float] = {}
+        self._next_prune = 0.0
+        self._semaphore = asyncio.Semaphore(Config.telegram_send_concurrency)
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+        self._requests: set[OutboundRequest] = set()
+        self._timers: set[asyncio.TimerHandle] = set()
+        self.dispatched = 0
+        self.retried = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def start(self) -> None:
+        """Запускает обработчик очереди в фоновой задаче."""
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Останавливает обработчик очереди.
+
+        Уже выполняющиеся запросы завершаются, а ожидающие в очереди
+        завершаются ошибкой, чтобы не повисли обработчики, которые их ждут.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await asyncio.gather(*self._running, return_exceptions=True)
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for request in list(self._requests):
+            if not request.future.done():
+                request.future.set_exception(
+                    RuntimeError("Очередь запросов к Telegram остановлена.")
+                )
+
+    async def call(
+        self, func, chat_id: int | str, priority: int = PRIORITY_NOTICE, **kwargs
+    ):
+        """
+        Ставит запрос к Telegram в очередь и дожидается его выполнения.
+
+        :param func: Метод бота, например context.bot.send_message
+        :param chat_id: ID чата
+        :param priority: PRIORITY_APPROVAL или PRIORITY_NOTICE
+        :param kwargs: Остальные аргументы метода
+        :return: Результат метода
+        :raises Exception: Ошибка метода или RetryAfter после исчерпания попыток
+        """
+
+        self.start()
+        request = OutboundRequest(func, chat_id, kwargs)
+        self._requests.add(request)
+        request.future.add_done_callback(lambda _: self._requests.discard(request))
+        self._queue.put_nowait((priority, next(self._sequence), request))
+        return await request.future
+
+    def _defer(self, delay: float, item: tuple) -> None:
+        """
+        Возвращает запрос в очередь через delay секунд, сохраняя его место в порядке.
+
+        :param delay: Задержка в секундах
+        :param item: Элемент очереди
+        """
+
+        def requeue():
+            self._timers.discard(timer)
+            self._queue.put_nowait(item)
+
+        timer = asyncio.get_running_loop().call_later(delay, requeue)
+        self._timers.add(timer)
+
+    async def _run(self) -> None:
+        """Цикл обработки очереди: выдает запросы с учетом лимитов Telegram."""
+
+        while True:
+            item = await self._queue.get()
+            _, _, request = item
+            if request.future.done():
+                continue
+
+            delay = self._chat_ready_at.get(request.chat_id, 0) - time.monotonic()
+            if delay > 0:
+                self._defer(delay, item)
+                continue
+
+            await self._bucket.acquire()
+            await self._semaphore.acquire()
+            now = time.monotonic()
+            if now >= self._next_prune:
+                self._prune_chats(now)
+            self._chat_ready_at[request.chat_id] = now + Config.telegram_chat_interval
+            waited = now - request.created_at
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.dispatched += 1
+
+            task = asyncio.create_task(self._execute(item))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _prune_chats(self, now: float) -> None:
+        """
+        Удаляет из расписания чаты, в которые уже можно отправлять запросы,
+        чтобы оно не росло со всеми чатами, куда бот когда-либо писал.
+
+        :param now: Текущее время по time.monotonic
+        """
+
+        self._chat_ready_at = {
+            chat_id: ready_at
+            for chat_id, ready_at in self._chat_ready_at.items()
+            if ready_at > now
+        }
+        self._next_prune = now + CHAT_READY_PRUNE_INTERVAL
+
+    async def _execute(self, item: tuple) -> None:
+        """
+        Выполняет запрос и передает результат ожидающему.
+
+        :param item: Элемент очереди
+        """
+
+        _, _, request = item
+        try:
+            result = await request.func(chat_id=request.chat_id, **request.kwargs)
+        except RetryAfter as e:
+            retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+            self._chat_ready_at[request.chat_id] = time.monotonic() + retry_after
+            request.attempts += 1
+            if request.attempts < Config.telegram_retry_attempts:
+                self.retried += 1
+                logger.warning(
+                    f"Telegram ограничил запросы в chat_id: {request.chat_id}, "
+                    f"повтор через {retry_after} с."
+                )
+                self._defer(retry_after, item)
+            else:
+                self.failed += 1
+                if not request.future.done():
+                    request.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._semaphore.release()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Возвращает глубину очереди и счетчики обработчика.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {
+            "queue_depth": self._queue.qsize() + len(self._timers),
+            "in_flight": len(self._running),
+            "tracked_chats": len(self._chat_ready_at),
+            "dispatched": self.dispatched,
+            "retried": self.retried,
+            "failed": self.failed,
+            "avg_wait": round(self.wait_time / self.dispatched, 3) if self.dispatched else 0.0,
+            "max_wait": round(self.max_wait, 3),
+            "throttle": self._bucket.stats(),
+        }
+
 
 class MessageManager:
     """Класс для хранения данных и отправки сообщений по отделам"""
@@ -27,10 +264,25 @@ class MessageManager:
         Инициализирует экземпляр MessageManager.
 
         Создает пустой словарь для хранения данных и устанавливает соединение с базой данных.
+        Данные записываются в таблицу message_state в фоне пачками и загружаются
+        из нее при первом обращении к счёту. В памяти хранится не больше
+        MESSAGE_MANAGER_MAX_SIZE счетов: давно не использованные и простаивающие дольше
+        MESSAGE_MANAGER_IDLE_TTL секунд вытесняются после записи в базу данных.
         """
 
-        self._data = {}
+        # порядок ключей - порядок последнего обращения, первым идет самый давний
+        self._data: OrderedDict[int, dict] = OrderedDict()
+        self._touched: dict[int, float] = {}
         self.db = db
+        self._dirty: set[int] = set()
+        self._deleted: set[int] = set()
+        # размер данных каждой ячейки в JSON на момент последней загрузки или записи
+        self._sizes: dict[int, int] = {}
+        self.approx_bytes = 0
+        self._flush_task: asyncio.Task | None = None
+        self.flushes = 0
+        self.evictions = 0
+        self.rehydrations = 0
         self.messages = {
             "initiator": INITIATOR,
             "head": HEAD,
@@ -43,10 +295,17 @@ class MessageManager:
         Позволяет обращаться к данным как к словарю.
 
         :param row_id: ID записи для доступа к соответствующим данным
-        :return: Словарь данных для указанного row_id или пустой словарь, если данные не найдены
+        :return: Словарь данных для указанного row_id
+        :raises KeyError: Если данные не загружены методом load (ещё не загружались,
+            были вытеснены или удалены)
         """
 
-        return self._data.get(row_id, {})
+        if row_id not in self._data:
+            raise KeyError(
+                f"Данные сообщений счёта №{row_id} не загружены: перед обращением нужен load."
+            )
+        self._touch(row_id)
+        return self._data[row_id]
 
     def __getattr__(self, name: str):
         """
@@ -73,20 +332,27 @@ class MessageManager:
 
         if not isinstance(value, dict):
             raise ValueError("Значение должно быть словарем.")
+        # явная запись заменяет данные целиком, в том числе удаленные
+        self._deleted.discard(row_id)
         self._data[row_id] = value
+        self._touch(row_id)
+        self._mark_dirty(row_id)
 
     def __delitem__(self, row_id: int):
         """
         Удаляет элемент по ID ячейки.
 
+        Данные удаляются и из базы данных при следующем сбросе, даже если они
+        не загружались в память или были вытеснены, поэтому повторное удаление не ошибка.
+
         :param row_id: ID ячейки для удаления
-        :raises KeyError: Если ID ячейки не найден
         """
 
-        if row_id in self._data:
-            del self._data[row_id]
-        else:
-            raise KeyError("ID ячейки не найден.")
+        self._data.pop(row_id, None)
+        self._touched.pop(row_id, None)
+        self._dirty.discard(row_id)
+        self._deleted.add(row_id)
+        self._forget_size(row_id)
 
     async def __call__(self, row_id: int) -> dict[str, int]:
         """
@@ -96,6 +362,8 @@ class MessageManager:
         :return: Словарь данных для указанного row_id
         """
 
+        await self.load(row_id)
+        self._touch(row_id)
         return {"row_id": row_id, **self._data.get(row_id, {})}
 
     async def update_data(self, row_id: int, data_dict: dict):
@@ -106,7 +374,199 @@ class MessageManager:
         :param data_dict: Словарь новых данных для обновления
         """
 
+        await self.load(row_id)
+        # данные удаленного счёта не создаются заново частичным словарем
+        if row_id in self._deleted:
+            return
         self._data.setdefault(row_id, {}).update(data_dict)
+        self._touch(row_id)
+        self._mark_dirty(row_id)
+
+    async def set_field(self, row_id: int, key: str, value) -> None:
+        """
+        Записывает одно значение в данные ячейки по ID.
+
+        :param row_id: ID ячейки для обновления
+        :param key: Ключ значения
+        :param value: Значение
+        """
+
+        await self.update_data(row_id, {key: value})
+
+    def _mark_dirty(self, row_id: int) -> None:
+        """
+        Отмечает данные ячейки для записи в базу данных при следующем сбросе.
+        Удаленные данные не отмечаются, чтобы не восстановить их в базе данных.
+
+        :param row_id: ID ячейки
+        """
+
+        if row_id not in self._deleted:
+            self._dirty.add(row_id)
+
+    def _remember_size(self, row_id: int, state: str) -> None:
+        """
+        Запоминает размер данных ячейки для примерной оценки занятой памяти.
+
+        :param row_id: ID ячейки
+        :param state: Данные ячейки в формате JSON
+        """
+
+        size = len(state.encode())
+        self.approx_bytes += size - self._sizes.get(row_id, 0)
+        self._sizes[row_id] = size
+
+    def _forget_size(self, row_id: int) -> None:
+        """
+        Исключает данные ячейки из оценки занятой памяти.
+
+        :param row_id: ID ячейки
+        """
+
+        self.approx_bytes -= self._sizes.pop(row_id, 0)
+
+    def _touch(self, row_id: int) -> None:
+        """
+        Отмечает обращение к данным ячейки для вытеснения давно не использованных.
+
+        :param row_id: ID ячейки
+        """
+
+        if row_id in self._data:
+            self._data.move_to_end(row_id)
+            self._touched[row_id] = time.monotonic()
+
+    def _evict(self) -> None:
+        """
+        Вытесняет из памяти давно не использованные данные при превышении
+        MESSAGE_MANAGER_MAX_SIZE и данные, простаивающие дольше MESSAGE_MANAGER_IDLE_TTL секунд.
+        Ещё не записанные в базу данных изменения не вытесняются.
+        """
+
+        now = time.monotonic()
+        excess = len(self._data) - Config.message_manager_max_size
+        for row_id in list(self._data):
+            idle = now - self._touched.get(row_id, now) > Config.message_manager_idle_ttl
+            if excess <= 0 and not idle:
+                break
+            if row_id in self._dirty:
+                continue
+            del self._data[row_id]
+            self._touched.pop(row_id, None)
+            self._forget_size(row_id)
+            self.evictions += 1
+            excess -= 1
+
+    async def load(self, row_id: int) -> None:
+        """
+        Загружает данные ячейки из базы данных, если их нет в памяти
+        (ещё не загружались или были вытеснены).
+
+        Ошибка чтения пробрасывается: иначе изменения записались бы
+        поверх сохраненного состояния частичным словарем.
+
+        :param row_id: ID ячейки
+        :raises RuntimeError: Если состояние не удалось прочитать из базы данных
+        """
+
+        if row_id in self._data or row_id in self._deleted:
+            return
+
+        try:
+            state = await self.db.get_message_state(row_id)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить состояние сообщений счёта №{row_id}: {e}")
+            raise RuntimeError(
+                f"Не удалось загрузить состояние сообщений счёта №{row_id}: {e}"
+            )
+
+        # пока шел запрос, данные могли появиться в памяти или быть удалены
+        if row_id in self._data or row_id in self._deleted:
+            return
+
+        # счёт без сохраненного состояния тоже отмечается загруженным пустым словарем
+        self._data[row_id] = json.loads(state) if state else {}
+        self._touch(row_id)
+        if state:
+            self._remember_size(row_id, state)
+            self.rehydrations += 1
+
+    async def flush(self) -> None:
+        """
+        Записывает в базу данных все измененные с прошлого сброса данные одной транзакцией.
+        При ошибке данные остаются отмеченными и будут записаны при следующем сбросе.
+        """
+
+        if not self._dirty and not self._deleted:
+            return
+
+        dirty, deleted = self._dirty, self._deleted
+        self._dirty, self._deleted = set(), set()
+        states = {
+            row_id: json.dumps(self._data[row_id], ensure_ascii=False, default=str)
+            for row_id in dirty
+            if row_id in self._data
+        }
+        for row_id, state in states.items():
+            self._remember_size(row_id, state)
+        try:
+            await self.db.save_message_states(states, list(deleted))
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние сообщений: {e}")
+            self._dirty |= dirty - self._deleted
+            self._deleted |= deleted - self._dirty
+            return
+        self.flushes += 1
+
+    def start(self) -> None:
+        """Запускает фоновую запись данных в базу данных."""
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и записывает оставшиеся изменения."""
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        """
+        Цикл фоновой записи: сбрасывает изменения каждые MESSAGE_STATE_FLUSH_INTERVAL секунд
+        и вытесняет из памяти лишние записанные данные.
+        """
+
+        while True:
+            await asyncio.sleep(Config.message_state_flush_interval)
+            await self.flush()
+            self._evict()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Возвращает количество записей в памяти, их примерный размер в байтах
+        и счетчики записи, вытеснения и загрузки.
+
+        Размер считается по JSON данных на момент их последней загрузки
+        или записи в базу данных, поэтому изменения после последнего сброса не учтены.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {
+            "entries": len(self._data),
+            "approx_bytes": self.approx_bytes,
+            "dirty": len(self._dirty),
+            "deleted": len(self._deleted),
+            "flushes": self.flushes,
+            "evictions": self.evictions,
+            "rehydrations": self.rehydrations,
+        }
 
     async def get_message(self, department, stage, **kwargs) -> str:
         """
@@ -131,6 +591,18 @@ class MessageManager:
             logger.error(f"Ошибка при форматировании сообщения: {e}")
             raise ValueError(f"Ошибка при форматировании сообщения: {e}")
 
+    async def _fan_out(self, items: list, send) -> list:
+        """
+        Выполняет запросы к Telegram для всех элементов одновременно.
+        Частоту и количество одновременных запросов ограничивает telegram_scheduler.
+
+        :param items: Элементы, для каждого из которых выполняется запрос
+        :param send: Асинхронная функция запроса для одного элемента
+        :return: Результаты или исключения запросов в порядке элементов
+        """
+
+        return await asyncio.gather(*(send(item) for item in items), return_exceptions=True)
+
     async def send_messages_with_tracking(
         self,
         context: ContextTypes.DEFAULT_TYPE,
@@ -164,24 +636,29 @@ class MessageManager:
         if isinstance(chat_ids, (int, str)):
             chat_ids = [chat_ids]
 
-        message_ids = []
-        actual_chat_ids = []
-        for chat_id in chat_ids:
-            try:
-                message = await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"{message_text}",
-                    reply_markup=reply_markup,
-                )
-                message_ids.append(message.message_id)
-                actual_chat_ids.append(chat_id)
-            except Exception as e:
+        # сообщения с кнопками ждут действия от получателя и отправляются раньше уведомлений
+        priority = PRIORITY_APPROVAL if reply_markup else PRIORITY_NOTICE
+
+        async def send(chat_id):
+            return await telegram_scheduler.call(
+                context.bot.send_message,
+                chat_id,
+                priority=priority,
+                text=f"{message_text}",
+                reply_markup=reply_markup,
+            )
+
+        sent_messages = []
+        results = await self._fan_out(chat_ids, send)
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
                 logger.info(
-                    f"🚨Ошибка при отправке сообщения в chat_id: {chat_id}. Ошибка: {e}"
+                    f"🚨Ошибка при отправке сообщения в chat_id: {chat_id}. Ошибка: {result}"
                 )
-                pass
+                continue
+            sent_messages.append((chat_id, result.message_id))
 
-        self[row_id][f"{department}_messages"] = list(zip(actual_chat_ids, message_ids))
+        await self.set_field(row_id, f"{department}_messages", sent_messages)
 
     async def resend_messages_with_tracking(
         self,
@@ -190,19 +667,26 @@ class MessageManager:
         department: str,
         stage: str,
         reply_markup: InlineKeyboardMarkup = None,
+        edit: bool = True,
     ) -> None:
         """
-        Отправляет новое и удаляет старое сообщение.
+        Обновляет отправленные отделу сообщения под новый этап.
+
+        Сообщения изменяются на месте. Новое сообщение отправляется, а старое удаляется,
+        только если изменить сообщение нельзя (например, оно удалено или слишком старое)
+        или если edit=False.
 
         :param context: Контекст бота Telegram
         :param row_id: ID записи для обновления
         :param department: Департамент для отправки сообщения
         :param stage: Этап одобрения для получения сообщения
         :param reply_markup: Опциональный параметр для кнопок ответа
+        :param edit: Изменять сообщения на месте
         :raises RuntimeError: Если по ключу department_messages нет данных
         """
 
         key = f"{department}_messages"
+        await self.load(row_id)
         if self[row_id].get(key) is None:
             raise RuntimeError(f"Ошибка! По ключу {department}_messages нет данных!")
 
@@ -215,21 +699,55 @@ class MessageManager:
                 f"Не удалось получить сообщение для отдела: {department} и этапа: {stage}"
             )
 
-        actual_chat_ids = []
-        message_ids = []
-        for chat_id, message_id in self[row_id].get(key):
+        priority = PRIORITY_APPROVAL if reply_markup else PRIORITY_NOTICE
+
+        async def resend(tracked_message):
+            chat_id, message_id = tracked_message
+            if edit:
+                try:
+                    # вместе с текстом заменяются и кнопки: без reply_markup они удаляются
+                    await telegram_scheduler.call(
+                        context.bot.edit_message_text,
+                        chat_id,
+                        priority=priority,
+                        message_id=message_id,
+                        text=f"{message_text}",
+                        reply_markup=reply_markup,
+                    )
+                    return message_id
+                except BadRequest as e:
+                    if "message is not modified" in e.message.lower():
+                        return message_id
+                    logger.info(
+                        f"Не удалось изменить сообщение {message_id} в chat_id: {chat_id}, "
+                        f"отправляется новое: {e}"
+                    )
+
+            message = await telegram_scheduler.call(
+                context.bot.send_message,
+                chat_id,
+                priority=priority,
+                text=f"{message_text}",
+                reply_markup=reply_markup,
+            )
             try:
-                message = await context.bot.send_message(
-                    chat_id=chat_id, text=f"{message_text}", reply_markup=reply_markup
+                await telegram_scheduler.call(
+                    context.bot.delete_message, chat_id, message_id=message_id
                 )
-                message_ids.append(message.message_id)
-                actual_chat_ids.append(chat_id)
-                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
             except Exception as e:
-                logger.error(f"Не удалось обновить сообщение с chat_id: {chat_id}: {e}")
-                pass
+                logger.error(f"Не удалось удалить сообщение с chat_id: {chat_id}: {e}")
+            return message.message_id
+
+        tracked_messages = self[row_id].get(key)
+        sent_messages = []
+        results = await self._fan_out(tracked_messages, resend)
+        for (chat_id, _), result in zip(tracked_messages, results):
+            if isinstance(result, Exception):
+                logger.error(f"Не удалось обновить сообщение с chat_id: {chat_id}: {result}")
+                continue
+            sent_messages.append((chat_id, result))
 
-        self[row_id][key] = list(zip(actual_chat_ids, message_ids))
+        await self.set_field(row_id, key, sent_messages)
 
     async def add_main_data(
         self, record_dict: dict, row_id, initiator_chat_id: str | int
@@ -262,4 +780,5 @@ class MessageManager:
             )
 
 
+telegram_scheduler = TelegramScheduler()
 message_manager = MessageManager()
@@ -63,3 +63,11 @@ PAYMENT = {
     "paid": "Счет №{row_id} оплачен {approver}.\n{record_data_text}",
     "rejected": "Счет №{row_id} отклонен {approver}.\n{record_data_text}",
 }
+
+STATUS_EVENTS = {
+    "Not processed": "создан",
+    "Pending": "согласован и передан в финансовый отдел",
+    "Approved": "одобрен и передан на оплату",
+    "Paid": "оплачен",
+    "Rejected": "отклонён",
+}
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Асинхронный ограничитель частоты запросов по алгоритму token bucket"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Инициализирует объект TokenBucket.
+
+        :param rate: Скорость пополнения в токенах в секунду; 0 отключает ограничение
+        :param capacity: Максимальное количество накопленных токенов (размер всплеска)
+        """
+
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _refill(self) -> None:
+        """Пополняет запас токенов пропорционально прошедшему времени."""
+
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """
+        Забирает один токен, при необходимости дожидаясь его появления.
+        Ожидающие получают токены в порядке очереди.
+
+        :return: Время ожидания в секундах
+        """
+
+        if self.rate <= 0:
+            return 0.0
+
+        async with self._lock:
+            self._refill()
+            delay = 0.0
+            if self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                self.waits += 1
+                self.wait_time += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self._tokens -= 1
+            return delay
+
+    def drain(self) -> None:
+        """Обнуляет запас токенов, например после ответа сервера о превышении квоты."""
+
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Возвращает счетчики ожиданий.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {"waits": self.waits, "wait_time": round(self.wait_time, 3)}
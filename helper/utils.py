@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 
 from config.config import Config
 from db import db
@@ -6,22 +6,20 @@ from helper.message_manager import message_manager
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 
-async def validate_period_dates(period: str) -> str:
+async def validate_period_dates(period: str) -> list[date]:
     """
     Проверяет корректность формата дат в периоде.
 
-    :param period: Строка с датами в формате dd.mm.yy
-    :return: Строка с датами в формате dd.mm.yyyy, разделенными пробелом
+    :param period: Строка с датами в формате mm.yy, разделенными пробелом
+    :return: Список дат начисления (первое число каждого месяца)
     :raises RuntimeError: При некорректном формате дат
     """
 
     try:
-        return " ".join(
-            [
-                datetime.strptime(f"01.{date}", "%d.%m.%y").strftime("%d.%m.%Y")
-                for date in period.split()
-            ]
-        )
+        return [
+            datetime.strptime(f"01.{date_}", "%d.%m.%y").date()
+            for date_ in period.split()
+        ]
     except Exception as e:
         raise RuntimeError(
             f"Введены неверные даты. Даты вводятся в формате mm.yy. "
@@ -38,10 +36,7 @@ async def get_record_by_id(row_id: int) -> dict:
     :return: Словарь с данными записи
     """
 
-    async with db:
-        record_dict = await db.get_row_by_id(row_id)
-
-    return record_dict
+    return await db.get_row_by_id(row_id)
 
 
 async def get_record_info(record_dict: dict) -> str:
@@ -52,13 +47,14 @@ async def get_record_info(record_dict: dict) -> str:
     :return: Форматированная строка с информацией о счете
     """
 
+    period = ", ".join(month.strftime("%d.%m.%Y") for month in record_dict["period"])
     return (
         f"Данные счета:\n"
         f'1.Сумма: {record_dict["amount"]}₽;\n'
         f'2.Статья: "{record_dict["item"]}"\n'
         f'3.Группа: "{record_dict["groupment"]}"\n'
         f'4.Комментарий: "{record_dict["comment"]}"\n'
-        f'5.Даты начисления: "{", ".join(record_dict["period"].split())}"\n'
+        f'5.Даты начисления: "{period}"\n'
         f'6.Форма оплаты: "{record_dict["payment_method"]}"\n'
     )
 
@@ -104,6 +100,31 @@ async def create_payment_keyboard(row_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
+async def create_not_paid_keyboard(
+        first_id: int, last_id: int, has_prev: bool, has_next: bool
+) -> InlineKeyboardMarkup | None:
+    """
+    Создание кнопок "Назад" и "Далее" для постраничного просмотра неоплаченных счетов.
+
+    :param first_id: ID первого счёта на текущей странице
+    :param last_id: ID последнего счёта на текущей странице
+    :param has_prev: Есть ли предыдущая страница
+    :param has_next: Есть ли следующая страница
+    :return: Объект InlineKeyboardMarkup с кнопками или None, если страница единственная
+    """
+
+    buttons = []
+    if has_prev:
+        buttons.append(
+            InlineKeyboardButton("◀ Назад", callback_data=f"not_paid_prev_{first_id}")
+        )
+    if has_next:
+        buttons.append(
+            InlineKeyboardButton("Далее ▶", callback_data=f"not_paid_next_{last_id}")
+        )
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
 async def split_long_message(message: str) -> list:
     """
     Разбивает длинное сообщение на части по 4096 символов.
@@ -186,26 +207,30 @@ async def add_data_to_message_manager(
         )
 
 
-async def update_storage_data(row_id, **kwargs: int | str | None) -> dict:
+async def update_storage_data(
+        row_id, expected_status: str | tuple[str, ...], **kwargs: int | str | None
+) -> dict | None:
     """
-    Обновляет данные в базе данных 'approvals' по номеру ячейки.
+    Атомарно обновляет статус счёта в базе данных 'approvals' по номеру ячейки.
 
     :param row_id: ID записи для обновления
+    :param expected_status: Статус (или кортеж статусов), из которого допустим переход
     :param kwargs: Ключевые слова для параметров обновления
-    :return: Словарь с обновленными данными
+        (status, approved_by, approvals_received, actor, department)
+    :return: Словарь с обновленными данными или None, если счёт уже обработан
     """
 
-    async with db:
-        exist_approver = await db.get_value("approved_by", row_id)
-        if exist_approver and kwargs.get("approved_by"):
-            kwargs["approved_by"] = f"{exist_approver} и {kwargs['approved_by']}"
-        update_data = {key: value for key, value in kwargs.items() if value is not None}
-        await db.update_row_by_id(row_id, update_data)
-        record_dict = await db.get_row_by_id(row_id)
+    # данные о сообщениях по счёту загружаются из базы данных до перехода,
+    # чтобы изменения после него ложились на сохраненное состояние, а не на пустое
+    await message_manager.load(row_id)
+
+    record_dict = await db.transition_status(row_id, expected_status, **kwargs)
+    if record_dict is None:
+        return None
 
     if kwargs.get("approved_by"):
         await message_manager.update_data(
-            row_id, {"approver": kwargs.get("approved_by")}
+            row_id, {"approver": record_dict.get("approved_by")}
         )
 
     return record_dict
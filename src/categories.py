@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+from config.config import Config
+from helper.logging_config import logger
+from src.sheets import sheets_manager
+
+
+class CategoriesCache:
+    """Общий для процесса снимок статей и групп из листа "категории" с фоновым обновлением"""
+
+    def __init__(self):
+        """
+        Инициализирует объект CategoriesCache.
+
+        Снимок загружается при первом обращении или при запуске фонового обновления.
+        """
+
+        self.options: dict[str, list[str]] | None = None
+        self.items: list[str] | None = None
+        self.revision: str | None = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.unchanged = 0
+        self.errors = 0
+
+    def _is_fresh(self) -> bool:
+        """
+        Проверяет, что снимок загружен и не старше CATEGORIES_CACHE_TTL секунд.
+
+        :return: True, если снимок можно отдавать без обращения к Google Sheets
+        """
+
+        return (
+            self.options is not None
+            and time.monotonic() - self._loaded_at < Config.categories_cache_ttl
+        )
+
+    async def get(self) -> tuple[dict[str, list[str]], list[str]]:
+        """
+        Возвращает статьи с группами и список статей.
+
+        Свежий снимок отдается без обращения к Google Sheets. Если снимок устарел,
+        он обновляется; при ошибке обновления отдается устаревший снимок, если он есть.
+
+        :return: Кортеж со словарем категорий и списком уникальных статей
+        :raises RuntimeError: Если снимок ни разу не удалось загрузить
+        """
+
+        if self._is_fresh():
+            self.hits += 1
+            return self.options, self.items
+
+        self.misses += 1
+        try:
+            await self.refresh(only_if_stale=True)
+        except Exception as e:
+            if self.options is None:
+                raise
+            logger.warning(f"Используется устаревший список категорий: {e}")
+        return self.options, self.items
+
+    async def refresh(self, force: bool = False, only_if_stale: bool = False) -> bool:
+        """
+        Обновляет снимок категорий.
+
+        Лист загружается заново, только если ревизия таблицы изменилась
+        с момента предыдущей загрузки или обновление принудительное.
+
+        :param force: Загрузить лист независимо от ревизии таблицы
+        :param only_if_stale: Ничего не делать, если снимок еще свежий
+        :return: True, если лист был загружен заново
+        """
+
+        async with self._lock:
+            # снимок мог обновить другой обработчик, пока этот ждал блокировку
+            if only_if_stale and self._is_fresh():
+                return False
+
+            try:
+                revision = await sheets_manager.get_revision()
+            except Exception as e:
+                logger.warning(f"Не удалось получить ревизию таблицы категорий: {e}")
+                revision = None
+
+            if (
+                not force
+                and self.options is not None
+                and revision is not None
+                and revision == self.revision
+            ):
+                self._loaded_at = time.monotonic()
+                self.unchanged += 1
+                return False
+
+            try:
+                self.options, self.items = await sheets_manager.get_data()
+            except Exception:
+                self.errors += 1
+                raise
+            self.revision = revision
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+            logger.info(f"Список категорий обновлён: {len(self.items)} статей.")
+            return True
+
+    def start(self) -> None:
+        """Запускает фоновое обновление снимка категорий."""
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновое обновление снимка категорий."""
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        """Цикл фонового обновления: проверяет ревизию таблицы каждые CATEGORIES_REFRESH_INTERVAL секунд."""
+
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Не удалось обновить список категорий: {e}")
+            await asyncio.sleep(Config.categories_refresh_interval)
+
+    def stats(self) -> dict[str, int | str | None]:
+        """
+        Возвращает счетчики работы кэша категорий.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {
+            "loaded": self.options is not None,
+            "revision": self.revision,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "unchanged": self.unchanged,
+            "errors": self.errors,
+        }
+
+
+categories_cache = CategoriesCache()
@@ -8,7 +8,7 @@ from helper.logging_config import logger
 from helper.user_data import get_nickname
 from helper.utils import validate_period_dates
 from src.handlers import submit_record_command
-from src.sheets import GoogleSheetsManager
+from src.categories import categories_cache
 
 (
     INPUT_SUM,
@@ -35,10 +35,10 @@ async def enter_record(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return ConversationHandler.END
 
-    # авторизуемся в Google Sheets, сохраняем данные о статьях, группах, партнёрах из таблицы "категории".
-    manager = GoogleSheetsManager()
-    await manager.initialize_google_sheets()
-    context.user_data["options"], context.user_data["items"] = await manager.get_data()
+    # сохраняем данные о статьях, группах, партнёрах из снимка таблицы "категории".
+    context.user_data["options"], context.user_data["items"] = (
+        await categories_cache.get()
+    )
 
     # отправляем сообщение "Введите сумму" от бота и сохраняем данные о нём.
     bot_message = await context.bot.send_message(
@@ -1,7 +1,12 @@
+from datetime import date
+from decimal import Decimal
+
+import pytz
 from config.config import Config
 from db import db
 from helper.logging_config import logger
-from helper.message_manager import message_manager
+from helper.message_manager import message_manager, telegram_scheduler
+from helper.messages import STATUS_EVENTS
 from helper.user_data import (
     get_nickname,
     get_department,
@@ -9,6 +14,7 @@ from helper.user_data import (
 from helper.utils import (
     validate_period_dates,
     split_long_message,
+    create_not_paid_keyboard,
     get_record_info,
     get_record_by_id,
     add_data_to_message_manager,
@@ -35,8 +41,9 @@ from src.approval_process import (
     head_reject_message,
     finance_reject_message,
 )
-from src.sheets import add_record_to_google_sheet
-from telegram import Update
+from src.categories import categories_cache
+from src.outbox import outbox_worker
+from telegram import Update, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 
@@ -107,9 +114,39 @@ async def submit_record_command(
     await head_from_initiator_approval_message(context, row_id)
 
 
+async def parse_record(
+    text: str, initiator_chat_id: int
+) -> dict[str, Decimal | str | int | list[date]]:
+    """
+    Разбирает строку с данными счёта в формате команды /submit_record:
+    "сумма; статья; группа; комментарий; даты; форма оплаты".
+
+    :param text: Строка с данными счёта
+    :param initiator_chat_id: ID чата инициатора счёта
+    :return: Словарь с данными платежа
+    :raises Exception: Если строку не удалось разобрать
+    """
+
+    user_args = [x.strip() for x in text.split(";")]
+    amount = Decimal(user_args[0])
+    return {
+        "amount": amount,
+        "item": user_args[1],
+        "groupment": user_args[2],
+        "comment": user_args[3],
+        "period": await validate_period_dates(user_args[4]),
+        "payment_method": user_args[5],
+        "approvals_needed": 1 if amount < 50000 else 2,
+        "approvals_received": 0,
+        "status": "Not processed",
+        "approved_by": None,
+        "initiator_id": initiator_chat_id,
+    }
+
+
 async def process_input(
     update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> dict[str, float | str | int]:
+) -> dict[str, Decimal | str | int | list[date]]:
     """
     Обработчик аргументов команды /submit_record.
 
@@ -122,20 +159,7 @@ async def process_input(
         initiator_chat_id = update.effective_chat.id
         if not context.args:
             raise ValueError("Необходимо указать данные счёта.")
-        user_args = [x.strip() for x in " ".join(context.args).split(";")]
-        record_dict = {
-            "amount": float(user_args[0]),
-            "item": user_args[1],
-            "groupment": user_args[2],
-            "comment": user_args[3],
-            "period": await validate_period_dates(user_args[4]),
-            "payment_method": user_args[5],
-            "approvals_needed": 1 if float(user_args[0]) < 50000 else 2,
-            "approvals_received": 0,
-            "status": "Not processed",
-            "approved_by": None,
-            "initiator_id": initiator_chat_id,
-        }
+        record_dict = await parse_record(" ".join(context.args), initiator_chat_id)
     except Exception as e:
         raise RuntimeError(
             f"Заданы неверные аргументы! Некоторые аргументы "
@@ -145,6 +169,60 @@ async def process_input(
     return record_dict
 
 
+async def submit_batch_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """
+    Обработчик команды /submit_batch.
+    Каждая строка сообщения после команды - отдельный счёт в формате /submit_record.
+    Все счета добавляются в базу данных одной транзакцией и отправляются на одобрение главе отдела.
+
+    :param update: Обновление чата
+    :param context: Контекст бота
+    """
+
+    initiator_chat_id = update.effective_chat.id
+    if initiator_chat_id not in Config.initiator_chat_ids:
+        await update.message.reply_text(
+            "Команда запрещена! Вы не находитесь в списке инициаторов."
+        )
+        return
+
+    command_and_body = update.message.text.split(maxsplit=1)
+    lines = (
+        [line.strip() for line in command_and_body[1].splitlines() if line.strip()]
+        if len(command_and_body) > 1
+        else []
+    )
+    if not lines:
+        await update.message.reply_text(
+            "Укажите данные счетов после команды, по одному счёту на строку."
+        )
+        return
+
+    records, errors = [], []
+    for number, line in enumerate(lines, start=1):
+        try:
+            records.append(await parse_record(line, initiator_chat_id))
+        except Exception as e:
+            errors.append(f"Строка {number}: {e}")
+    if errors:
+        await update.message.reply_text(
+            "Счета не добавлены, исправьте ошибки:\n" + "\n".join(errors)
+        )
+        return
+
+    row_ids = await db.insert_records(records)
+    await update.message.reply_text(
+        f"Добавлено счетов: {len(row_ids)} (№{', №'.join(map(str, row_ids))}).\n"
+        f"Счета переданы на согласование руководителю HR отдела."
+    )
+
+    for row_id, record_dict in zip(row_ids, records):
+        await add_data_to_message_manager(record_dict, row_id, initiator_chat_id)
+        await head_from_initiator_approval_message(context, row_id)
+
+
 async def add_record_to_storage(update: Update, record_dict: dict) -> int:
     """
     Добавляет запись в базу данных и обновляет данные экземпляра класса MessageManager.
@@ -156,8 +234,7 @@ async def add_record_to_storage(update: Update, record_dict: dict) -> int:
 
     try:
         initiator_chat_id = update.effective_chat.id
-        async with db:
-            row_id = await db.insert_record(record_dict)
+        row_id = await db.insert_record(record_dict)
     except Exception as e:
         raise RuntimeError(f"Ошибка при добавлении данных в базу данных: {e}")
 
@@ -183,11 +260,13 @@ async def approval_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     except Exception as e:
         raise RuntimeError(f'Ошибка обработки кнопок "Одобрить" и "Отклонить". {e}')
 
-    async with db:
-        record_dict = await db.get_row_by_id(row_id)
+    record_dict = await db.get_row_by_id(row_id)
+    # нажатие по уже обработанному счёту: его данные сообщений удалены
+    if not record_dict or record_dict.get("status") in ("Paid", "Rejected"):
+        return
     amount = record_dict.get("amount")
 
-    if not message_manager[row_id].get("record_data_text"):
+    if not (await message_manager(row_id)).get("record_data_text"):
         initiator_chat_id = record_dict.get("initiator_id")
         await add_data_to_message_manager(record_dict, row_id, initiator_chat_id)
 
@@ -203,7 +282,7 @@ async def approval_process(
     row_id: int,
     approver: str,
     department: str,
-    amount: float,
+    amount: Decimal,
     approver_id: int,
 ) -> None:
     """
@@ -232,7 +311,7 @@ async def approval_process(
             )
 
     else:
-        await reject_record(context, row_id, approver)
+        await reject_record(context, row_id, approver, department)
 
 
 async def approve_to_finance_department(
@@ -253,10 +332,15 @@ async def approve_to_finance_department(
     # меняем статус и добавляем апрув в базу данных
     record_dict = await update_storage_data(
         row_id,
+        "Not processed",
         approved_by=approver,
         status="Pending",
-        approvals_received=1
+        approvals_received=1,
+        actor=approver,
+        department="head",
     )
+    if record_dict is None:
+        return
 
     # меняем или отправляем сообщение инициатору
     await initiator_head_to_finance_message(context, row_id, record_dict)
@@ -281,10 +365,15 @@ async def approve_head_to_payment_department(
 
     record_dict = await update_storage_data(
         row_id,
+        "Not processed",
         approved_by=approver,
         status="Approved",
         approvals_received=1,
+        actor=approver,
+        department="head",
     )
+    if record_dict is None:
+        return
 
     await initiator_head_to_payment_message(context, row_id, record_dict)
 
@@ -308,10 +397,15 @@ async def approve_finance_to_payment_department(
 
     record_dict = await update_storage_data(
         row_id,
+        "Pending",
         approved_by=approver,
         status="Approved",
         approvals_received=2,
+        actor=approver,
+        department="finance",
     )
+    if record_dict is None:
+        return
 
     await initiator_head_and_finance_to_payment_message(context, row_id)
 
@@ -338,8 +432,6 @@ async def payment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         response_list = query.data.split("_")
         row_id = int(response_list[1])
         payment_chat_id = query.from_user.id
-        approver = await get_nickname("payment", query.from_user.id)
-        await message_manager.update_data(row_id, {"approver": approver})
     except Exception as e:
         raise RuntimeError(f'Ошибка считывания данных с кнопки "Оплачено". Ошибка: {e}')
 
@@ -347,18 +439,28 @@ async def payment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 async def reject_record(
-    context: ContextTypes.DEFAULT_TYPE, row_id: int, approver: str
-) -> None:
+    context: ContextTypes.DEFAULT_TYPE, row_id: int, approver: str, department: str
+) -> bool:
     """
     Отправка сообщения об отклонении платежа и изменение статуса платежа.
 
     :param context: Контекст бота
     :param row_id: ID записи в базе данных
     :param approver: Сотрудник, принявший решение о отклонении
+    :param department: Департамент сотрудника, принявшего решение
+    :return: True, если счёт отклонён, False, если он уже был обработан
     """
 
+    record_dict = await update_storage_data(
+        row_id,
+        ("Not processed", "Pending", "Approved"),
+        status="Rejected",
+        actor=approver,
+        department=department,
+    )
+    if record_dict is None:
+        return False
     await message_manager.update_data(row_id, {"approver": approver})
-    record_dict = await update_storage_data(row_id, status="Rejected")
 
     await initiator_reject_message(context, row_id, record_dict)
 
@@ -368,23 +470,44 @@ async def reject_record(
         await finance_reject_message(context, row_id, record_dict, approver)
 
     del message_manager[row_id]
+    return True
 
 
 async def make_payment(
     context: ContextTypes.DEFAULT_TYPE, row_id: int, payment_chat_id: int
-) -> None:
+) -> bool:
     """
-    Добавление записи в Google Sheets после успешного платежа.
+    Изменение статуса счёта на "Paid" с постановкой в очередь записи в Google Sheets
+    и изменение сообщений в чатах после успешного платежа.
 
     :param context: Контекст бота
     :param row_id: ID записи в базе данных
     :param payment_chat_id: ID чата пользователя, выполнившего оплату
+    :return: True, если счёт оплачен, False, если он уже был обработан
     """
 
-    record_dict = await update_storage_data(row_id, status="Paid")
+    approver = await get_nickname("payment", payment_chat_id)
+    record_dict = await update_storage_data(
+        row_id,
+        "Approved",
+        status="Paid",
+        actor=approver,
+        department="payment",
+    )
+    if record_dict is None:
+        return False
+
+    # оплативший записывается только после перехода: повторное нажатие "Оплачено"
+    # по уже оплаченному счёту не должно восстанавливать удаленные данные сообщений
+    await message_manager.update_data(row_id, {"approver": approver})
+
+    # счёт поставлен в очередь записи в Google Sheets вместе со статусом "Paid"
+    outbox_worker.wake()
 
     if not message_manager[row_id].get("record_data_text"):
-        message_manager[row_id]["record_data_text"] = await get_record_info(record_dict)
+        await message_manager.update_data(
+            row_id, {"record_data_text": await get_record_info(record_dict)}
+        )
 
     await initiator_paid_message(context, row_id, record_dict)
 
@@ -396,8 +519,7 @@ async def make_payment(
     await payment_paid_message(context, row_id, payment_chat_id)
 
     del message_manager[row_id]
-
-    await add_record_to_google_sheet(record_dict)
+    return True
 
 
 async def reject_record_command(
@@ -424,11 +546,14 @@ async def reject_record_command(
         await update.message.reply_text("Вы не можете менять статус счёта!")
         return
 
-    row_id = row_id[0]
+    try:
+        row_id = int(row_id[0])
+    except ValueError:
+        await update.message.reply_text("Ошибка! Id счёта должен быть числом!")
+        return
 
     approver = await get_nickname(department, approver_id)
-    async with db:
-        record_dict = await db.get_row_by_id(row_id)
+    record_dict = await db.get_row_by_id(row_id)
     if not record_dict:
         await update.message.reply_text(f"Счёт с id: {row_id} не найден.")
         return
@@ -466,8 +591,10 @@ async def reject_record_command(
     await message_manager.update_data(
         row_id, {"record_data_text": await get_record_info(record_dict)}
     )
-    await reject_record(context, row_id, approver)
-    await update.message.reply_text(f"Счёт №{row_id} отклонён!")
+    if await reject_record(context, row_id, approver, department):
+        await update.message.reply_text(f"Счёт №{row_id} отклонён!")
+    else:
+        await update.message.reply_text(f"Счёт №{row_id} уже обработан")
 
 
 async def approve_record_command(
@@ -532,7 +659,7 @@ async def approve_record_command(
     approver = await get_nickname(department, approver_id)
     await message_manager.update_data(row_id, {"approver": approver})
 
-    if not message_manager[row_id].get("record_data_text"):
+    if not (await message_manager(row_id)).get("record_data_text"):
         await add_data_to_message_manager(record_dict, row_id, initiator_chat_id)
 
     if department in ("head", "finance"):
@@ -541,7 +668,8 @@ async def approve_record_command(
         )
 
     elif department == "payment":
-        await make_payment(context, row_id, approver_id)
+        if not await make_payment(context, row_id, approver_id):
+            await update.message.reply_text("Счёт уже обработан!")
 
 
 async def check_status_command(
@@ -563,10 +691,8 @@ async def check_status_command(
         await update.message.reply_text("Можно указать только 1 счёт!")
         return
 
-    record_dict = {}
     row_id = int(row_id[0])
-    async with db:
-        record_dict = await db.get_row_by_id(row_id)
+    record_dict = await db.get_row_by_id(row_id)
     if not record_dict:
         await update.message.reply_text("По данному id данных не найдено!")
         return
@@ -584,40 +710,161 @@ async def check_status_command(
         status, "Ожидается информация по статусу счёта."
     )
 
+    events = await db.get_events(row_id)
+    if events:
+        status_message += "\n\nИстория счёта:\n" + await format_timeline(events)
+
     await update.message.reply_text(status_message)
 
 
+async def format_timeline(events: list[dict]) -> str:
+    """
+    Форматирует историю изменений статуса счёта для отправки ботом.
+
+    :param events: Список событий журнала в хронологическом порядке
+    :return: Форматированная строка с историей счёта
+    """
+
+    moscow_tz = pytz.timezone("Europe/Moscow")
+    lines = []
+    for event in events:
+        created_at = event["created_at"].astimezone(moscow_tz).strftime("%d.%m.%Y %H:%M")
+        action = STATUS_EVENTS.get(event["to_status"], event["to_status"])
+        lines.append(f"{created_at} - {action} ({event['actor'] or event['department']})")
+    return "\n".join(lines)
+
+
+async def get_not_paid_page(
+    after_id: int | None = None, before_id: int | None = None
+) -> tuple[str | None, InlineKeyboardMarkup | None]:
+    """
+    Формирует текст и клавиатуру страницы неоплаченных счетов.
+
+    :param after_id: ID, после которого начинается страница
+    :param before_id: ID, перед которым заканчивается страница
+    :return: Кортеж из текста страницы (None, если счетов нет) и клавиатуры навигации
+    """
+
+    page_size = Config.not_paid_page_size
+    records, has_more = await db.find_not_paid_page(page_size, after_id, before_id)
+    if not records and (after_id is not None or before_id is not None):
+        # счета соседней страницы успели обработать - возвращаемся к началу списка
+        after_id = before_id = None
+        records, has_more = await db.find_not_paid_page(page_size)
+    if not records:
+        return None, None
+
+    if before_id is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after_id is not None, has_more
+
+    messages = [
+        db.format_record_info(
+            record_dict, await get_nickname("initiator", record_dict["initiator_id"])
+        )
+        for record_dict in records
+    ]
+    # страница должна уместиться в одно сообщение Telegram: не поместившиеся счета
+    # остаются соседней странице, а курсоры строятся только по показанным счетам
+    backward = before_id is not None
+    shown, length = 0, -1
+    for message in reversed(messages) if backward else messages:
+        length += len(message) + 1
+        if shown and length > 4096:
+            break
+        shown += 1
+    if shown < len(records):
+        if backward:
+            records, messages = records[-shown:], messages[-shown:]
+            has_prev = True
+        else:
+            records, messages = records[:shown], messages[:shown]
+            has_next = True
+
+    text = (await split_long_message("\n".join(messages)))[0]
+    keyboard = await create_not_paid_keyboard(
+        records[0]["id"], records[-1]["id"], has_prev, has_next
+    )
+    return text, keyboard
+
+
 async def show_not_paid_command(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """
-    Возвращает инициатору список неоплаченных заявок на платежи из таблицы "approvals".
+    Возвращает инициатору первую страницу неоплаченных заявок на платежи из таблицы "approvals".
 
     :param update: Обновление чата
     :param context: Контекст бота
     """
 
-    messages = []
-    async with db:
-        rows_ids = await db.find_not_paid()
-        if rows_ids:
-            for row_id in rows_ids:
-                record_data_text = await db.get_record_info(row_id)
-                messages.append(record_data_text)
-
-    final_text = "\n".join(messages)
-    if not final_text:
+    text, keyboard = await get_not_paid_page()
+    if not text:
         await update.message.reply_text("Заявок не обнаружено")
         return
 
-    if len(final_text) >= 4096:  # Максимальная длина сообщения в Telegram
-        parts = await split_long_message(final_text)
-        for part in parts:
-            await update.message.reply_text(part, parse_mode="HTML")
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+async def refresh_categories_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """
+    Обработчик команды /refresh_categories.
+    Принудительно загружает список статей и групп из таблицы "категории".
+
+    :param update: Обновление чата
+    :param context: Контекст бота
+    """
+
+    if update.effective_chat.id not in Config.admin_chat_ids:
+        await update.message.reply_text(
+            "Команда запрещена! Вы не находитесь в списке администраторов."
+        )
+        return
+
+    try:
+        await categories_cache.refresh(force=True)
+    except Exception as e:
+        logger.error(f"Не удалось обновить список категорий: {e}")
+        await update.message.reply_text("Не удалось обновить список категорий.")
+        return
+
+    await update.message.reply_text(
+        f"Список категорий обновлён: {len(categories_cache.items)} статей."
+    )
+
+
+async def not_paid_page_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """
+    Обработчик нажатий кнопок "Назад" и "Далее" в списке неоплаченных счетов.
+    Загружает запрошенную страницу и изменяет то же сообщение.
+
+    :param update: Обновление чата
+    :param context: Контекст бота
+    """
+
+    query = update.callback_query
+    await query.answer()
+    try:
+        _, _, direction, row_id = query.data.split("_")
+        row_id = int(row_id)
+    except Exception as e:
+        raise RuntimeError(f'Ошибка обработки кнопок "Назад" и "Далее". {e}')
+
+    if direction == "next":
+        text, keyboard = await get_not_paid_page(after_id=row_id)
     else:
-        await update.message.reply_text(final_text, parse_mode="HTML")
+        text, keyboard = await get_not_paid_page(before_id=row_id)
 
-    return
+    if not text:
+        await query.edit_message_text("Заявок не обнаружено")
+        return
+
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=keyboard)
 
 
 async def error_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -637,9 +884,13 @@ async def error_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             message_to_developer = await split_long_message(message_text)
             # Отправляем каждую часть сообщения по отдельности
             for part in message_to_developer:
-                await context.bot.send_message(Config.developer_chat_id, part)
+                await telegram_scheduler.call(
+                    context.bot.send_message, Config.developer_chat_id, text=part
+                )
         else:
-            await context.bot.send_message(Config.developer_chat_id, message_text)
+            await telegram_scheduler.call(
+                context.bot.send_message, Config.developer_chat_id, text=message_text
+            )
         logger.error(f"{message_text}\n{error_traceback}")
 
     except Exception as e:
@@ -648,6 +899,10 @@ async def error_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if len(message_text) > 4096:
             message_text = await split_long_message(message_text)
             for part in message_text:
-                await context.bot.send_message(Config.developer_chat_id, part)
+                await telegram_scheduler.call(
+                    context.bot.send_message, Config.developer_chat_id, text=part
+                )
         else:
-            await context.bot.send_message(Config.developer_chat_id, message_text)
+            await telegram_scheduler.call(
+                context.bot.send_message, Config.developer_chat_id, text=message_text
+            )
@@ -1,5 +1,7 @@
 from config.config import Config
+from db import db
 from flask import Flask, jsonify
+from helper.message_manager import message_manager, telegram_scheduler
 from src.conversation_handler import (
     enter_record,
     input_sum,
@@ -14,15 +16,22 @@ from src.conversation_handler import (
 from src.handlers import (
     start_command,
     submit_record_command,
+    submit_batch_command,
     approval_handler,
     payment_handler,
     show_not_paid_command,
+    refresh_categories_command,
+    not_paid_page_handler,
     approve_record_command,
     reject_record_command,
     check_status_command,
     error_callback,
     check_access_command,
 )
+from src.categories import categories_cache
+from src.outbox import outbox_worker
+from src.reconciliation import reconciler
+from src.sheets import sheets_manager
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -60,25 +69,87 @@ def readiness_check():
     )
 
 
+@app.route("/metrics")
+def metrics():
+    return (
+        jsonify(
+            {
+                "row_cache": db.row_cache.stats(),
+                "sheets_outbox": outbox_worker.stats(),
+                "sheets_reconciliation": reconciler.stats(),
+                "categories": categories_cache.stats(),
+                "sheets_api": sheets_manager.stats(),
+                "telegram": telegram_scheduler.stats(),
+                "message_manager": message_manager.stats(),
+            }
+        ),
+        200,
+    )
+
+
+async def on_startup(application: Application) -> None:
+    """
+    Подготавливает ресурсы бота перед началом обработки обновлений.
+
+    :param application: Приложение Telegram бота
+    """
+
+    await db.startup()
+    await sheets_manager.startup()
+    categories_cache.start()
+    telegram_scheduler.start()
+    message_manager.start()
+    outbox_worker.start()
+    reconciler.start()
+
+
+async def on_shutdown(application: Application) -> None:
+    """
+    Освобождает ресурсы бота при остановке приложения.
+
+    :param application: Приложение Telegram бота
+    """
+
+    await reconciler.stop()
+    await outbox_worker.stop()
+    await categories_cache.stop()
+    await telegram_scheduler.stop()
+    await message_manager.stop()
+    await db.close()
+
+
 def main() -> None:
     """Основная функция для запуска бота."""
-    application = Application.builder().token(Config.telegram_bot_token).build()
+    application = (
+        Application.builder()
+        .token(Config.telegram_bot_token)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # application.add_handler(
     #     MessageHandler(~filters.User(user_id=Config.white_list), check_access_command)
     # )
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("submit_record", submit_record_command))
+    application.add_handler(CommandHandler("submit_batch", submit_batch_command))
     application.add_handler(CommandHandler("reject_record", reject_record_command))
     application.add_handler(CommandHandler("approve_record", approve_record_command))
     application.add_handler(CommandHandler("show_not_paid", show_not_paid_command))
     application.add_handler(CommandHandler("check", check_status_command))
+    application.add_handler(
+        CommandHandler("refresh_categories", refresh_categories_command)
+    )
     application.add_handler(
         CallbackQueryHandler(approval_handler, pattern="^approval_.*")
     )
     application.add_handler(
         CallbackQueryHandler(payment_handler, pattern="^payment_.*")
     )
+    application.add_handler(
+        CallbackQueryHandler(not_paid_page_handler, pattern="^not_paid_.*")
+    )
 
     conversation_handler = ConversationHandler(
         entry_points=[CommandHandler("enter_record", enter_record)],
@@ -0,0 +1,266 @@
+import asyncio
+import random
+
+from config.config import Config
+from db import db
+from helper.logging_config import logger
+from src.sheets import (
+    add_rows_to_google_sheet,
+    construct_rows,
+    find_rows_in_google_sheet,
+    get_range_rows,
+    get_today_moscow_time,
+)
+
+
+class SheetsOutboxWorker:
+    """Фоновый обработчик очереди записи оплаченных счетов в Google Sheets"""
+
+    def __init__(self):
+        """
+        Инициализирует объект SheetsOutboxWorker.
+
+        Создает событие для пробуждения обработчика и счетчики его работы.
+        """
+
+        self._task: asyncio.Task | None = None
+        self._wake_event = asyncio.Event()
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.flushes = 0
+        self.skipped = 0
+
+    def start(self) -> None:
+        """Запускает обработку очереди в фоновой задаче."""
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Обработчик очереди Google Sheets запущен.")
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу обработки очереди."""
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Обработчик очереди Google Sheets остановлен.")
+
+    def wake(self) -> None:
+        """Будит обработчик, не дожидаясь интервала опроса очереди."""
+
+        self._wake_event.set()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Возвращает счетчики работы обработчика.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {
+            "sent": self.sent,
+            "flushes": self.flushes,
+            "skipped": self.skipped,
+            "retried": self.retried,
+            "dead": self.dead,
+        }
+
+    async def _run(self) -> None:
+        """
+        Цикл обработки очереди: обрабатывает готовые записи, затем ждет пробуждения.
+
+        После пробуждения обработчик выжидает sheets_outbox_flush_interval секунд,
+        чтобы оплаты, пришедшие почти одновременно, ушли в таблицу одной пачкой.
+        """
+
+        while True:
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обработки очереди Google Sheets: {e}")
+                processed = 0
+
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(
+                    self._wake_event.wait(), Config.sheets_outbox_poll_interval
+                )
+                await asyncio.sleep(Config.sheets_outbox_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_event.clear()
+
+    async def process_batch(self) -> int:
+        """
+        Отправляет в Google Sheets одну пачку записей очереди.
+
+        Строки всех счетов пачки записываются в таблицу одним запросом в порядке
+        очереди. Если запрос не удался, повтор откладывается для каждой записи пачки,
+        а записи запоминают диапазон ниже последней записанной оплаты, если она есть:
+        строки неудачного запроса могли быть добавлены в таблицу. Перед повторной
+        записью строки счёта ищутся в этом диапазоне, и найденные не дописываются
+        второй раз.
+
+        :return: Количество обработанных записей
+        """
+
+        records = await db.claim_outbox(
+            Config.sheets_outbox_batch_size, Config.sheets_outbox_lease
+        )
+        if not records:
+            return 0
+
+        today_date = await get_today_moscow_time()
+        batch = []
+        for record_dict in records:
+            outbox_id = record_dict.pop("outbox_id")
+            attempts = record_dict.pop("outbox_attempts")
+            search_range = record_dict.pop("outbox_range")
+            try:
+                record_rows = await construct_rows(record_dict, today_date)
+            except Exception as e:
+                await self._fail(outbox_id, record_dict["id"], attempts, e)
+                continue
+
+            batch.append(
+                (outbox_id, record_dict["id"], attempts, record_rows, search_range)
+            )
+
+        batch = await self._skip_written(batch)
+        if not batch:
+            return len(records)
+
+        rows = [row for _, _, _, record_rows, _ in batch for row in record_rows]
+        try:
+            # без записанных ранее диапазонов неизвестно, где искать строки
+            # неудачной записи: тогда при повторе строки дописываются без проверки
+            last_range = await db.get_last_sheet_range()
+            search_range = (
+                f"B{get_range_rows(last_range)[1] + 1}:J" if last_range else None
+            )
+        except Exception as e:
+            for outbox_id, row_id, attempts, _, _ in batch:
+                await self._fail(outbox_id, row_id, attempts, e)
+            return len(records)
+
+        try:
+            updated_range = await add_rows_to_google_sheet(rows)
+        except Exception as e:
+            for outbox_id, row_id, attempts, _, _ in batch:
+                await self._fail(outbox_id, row_id, attempts, e, search_range)
+            return len(records)
+
+        # диапазоны строк каждого счёта нужны для сверки с таблицей
+        sheet_ranges = []
+        next_row = get_range_rows(updated_range)[0] if updated_range else None
+        for _, _, _, record_rows, _ in batch:
+            if next_row is None or not record_rows:
+                sheet_ranges.append(None)
+                continue
+            sheet_ranges.append(f"B{next_row}:J{next_row + len(record_rows) - 1}")
+            next_row += len(record_rows)
+
+        await db.complete_outbox(
+            [outbox_id for outbox_id, _, _, _, _ in batch], sheet_ranges
+        )
+        self.sent += len(batch)
+        self.flushes += 1
+        logger.info(
+            f"Счета №{', '.join(str(row_id) for _, row_id, _, _, _ in batch)} "
+            f"добавлены в Google Sheets ({len(rows)} строк)."
+        )
+
+        return len(records)
+
+    async def _skip_written(self, batch: list[tuple]) -> list[tuple]:
+        """
+        Ищет в таблице строки счетов пачки, у записей которых сохранен диапазон,
+        и отмечает найденные как отправленные.
+
+        :param batch: Записи пачки: ID записи очереди, ID счёта, количество попыток,
+            строки счёта и диапазон для поиска
+        :return: Записи пачки, строки которых нужно дописать в таблицу
+        """
+
+        searched = [entry for entry in batch if entry[4]]
+        if not searched:
+            return batch
+
+        try:
+            found = await find_rows_in_google_sheet(
+                [(entry[4], entry[3]) for entry in searched]
+            )
+        except Exception as e:
+            # без проверки строки могли бы быть записаны второй раз
+            for outbox_id, row_id, attempts, _, _ in searched:
+                await self._fail(outbox_id, row_id, attempts, e)
+            return [entry for entry in batch if not entry[4]]
+
+        written = {
+            entry[0]: found_range
+            for entry, found_range in zip(searched, found)
+            if found_range
+        }
+        if written:
+            await db.complete_outbox(list(written), list(written.values()))
+            self.skipped += len(written)
+            logger.info(
+                f"Счета №{', '.join(str(e[1]) for e in searched if e[0] in written)} "
+                f"уже есть в Google Sheets и повторно не записаны."
+            )
+        return [entry for entry in batch if entry[0] not in written]
+
+    async def _fail(
+        self,
+        outbox_id: int,
+        row_id: int,
+        attempts: int,
+        error: Exception,
+        search_range: str | None = None,
+    ) -> None:
+        """
+        Откладывает запись очереди с экспоненциальной задержкой
+        или переводит ее в 'dead' после исчерпания попыток.
+
+        :param outbox_id: ID записи очереди
+        :param row_id: ID счёта
+        :param attempts: Количество предыдущих попыток
+        :param error: Ошибка отправки
+        :param search_range: Диапазон, в котором могли оказаться строки неудачной записи
+        """
+
+        delay = min(
+            Config.sheets_outbox_backoff_base * 2**attempts,
+            Config.sheets_outbox_backoff_max,
+        )
+        delay *= random.uniform(0.8, 1.2)
+        status = await db.fail_outbox(
+            outbox_id,
+            str(error),
+            Config.sheets_outbox_max_attempts,
+            delay,
+            search_range,
+        )
+        if status == "dead":
+            self.dead += 1
+            logger.error(
+                f"Счёт №{row_id} не удалось добавить в Google Sheets "
+                f"после {attempts + 1} попыток: {error}"
+            )
+        else:
+            self.retried += 1
+            logger.warning(
+                f"Счёт №{row_id} не добавлен в Google Sheets, "
+                f"повтор через {delay:.0f} с: {error}"
+            )
+
+
+outbox_worker = SheetsOutboxWorker()
@@ -0,0 +1,156 @@
+import asyncio
+
+from config.config import Config
+from db import db
+from helper.logging_config import logger
+from src.outbox import outbox_worker
+from src.sheets import sheets_manager
+
+
+class SheetsReconciler:
+    """Фоновая сверка оплаченных счетов из базы данных с таблицей Google Sheets"""
+
+    def __init__(self):
+        """
+        Инициализирует объект SheetsReconciler.
+
+        Курсор сверки хранится в базе данных, поэтому каждый запуск
+        проверяет только оплаты, появившиеся после предыдущего.
+        """
+
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.checked = 0
+        self.requeued = 0
+        self.mismatched = 0
+        self.dead = 0
+        self.recheck = 0
+
+    def start(self) -> None:
+        """Запускает сверку в фоновой задаче."""
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу сверки."""
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict[str, int]:
+        """
+        Возвращает счетчики сверки.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {
+            "runs": self.runs,
+            "checked": self.checked,
+            "requeued": self.requeued,
+            "mismatched": self.mismatched,
+            "dead": self.dead,
+            "recheck": self.recheck,
+        }
+
+    async def _run(self) -> None:
+        """Цикл сверки: сверяет новые оплаты пачками, затем ждет SHEETS_RECONCILE_INTERVAL секунд."""
+
+        while True:
+            try:
+                while await self.reconcile_batch() >= Config.sheets_reconcile_batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка сверки с Google Sheets: {e}")
+            await asyncio.sleep(Config.sheets_reconcile_interval)
+
+    async def reconcile_batch(self) -> int:
+        """
+        Сверяет с таблицей одну пачку оплат после курсора и сдвигает курсор.
+
+        Для каждой оплаты читается только диапазон, в который были записаны её строки;
+        все диапазоны пачки читаются одним запросом. Счёт ставится в очередь повторно,
+        если записи в очереди по нему нет, диапазон записи неизвестен или пуст.
+        Счета, запись которых в очереди переведена в 'dead' после исчерпания попыток,
+        повторно не ставятся: они только учитываются в счетчике dead.
+        Если в диапазоне оказались строки другого счёта, строки могли быть
+        перемещены вручную, поэтому счёт не ставится в очередь, а только учитывается
+        в счетчике mismatched.
+
+        Оплаты, которые еще ожидают отправки, и повторно поставленные в очередь счета
+        не задерживают курсор: они сохраняются вместе с ним и сверяются
+        при каждом следующем запуске, пока не окажутся в таблице.
+
+        :return: Количество новых оплат, сверенных после курсора
+        """
+
+        cursor, recheck_ids = await db.get_reconciliation_cursor()
+        records = await db.find_paid_since(
+            cursor, Config.sheets_reconcile_batch_size, Config.sheets_reconcile_grace
+        )
+        rechecked = await db.find_paid_by_ids(recheck_ids) if recheck_ids else []
+        if not records and not recheck_ids:
+            return 0
+
+        candidates = {r["id"]: r for r in rechecked}
+        candidates.update((r["id"], r) for r in records)
+        pending = [i for i, r in candidates.items() if r["outbox_status"] == "pending"]
+        reconciled = [r for r in candidates.values() if r["outbox_status"] != "pending"]
+
+        written = [r for r in reconciled if r["outbox_status"] == "done" and r["sheet_range"]]
+        values = await sheets_manager.get_payment_ranges(
+            [r["sheet_range"] for r in written]
+        )
+
+        dead = [r["id"] for r in reconciled if r["outbox_status"] == "dead"]
+        if dead:
+            self.dead += len(dead)
+            logger.error(
+                f"Счета №{', '.join(map(str, dead))} не записаны в Google Sheets: "
+                f"попытки записи исчерпаны."
+            )
+
+        missing = [
+            r["id"]
+            for r in reconciled
+            if r["outbox_status"] is None
+            or (r["outbox_status"] == "done" and not r["sheet_range"])
+        ]
+        for record_dict, rows in zip(written, values):
+            if not any(any(cell for cell in row) for row in rows):
+                missing.append(record_dict["id"])
+            elif any(len(row) < 3 or row[2] != record_dict["item"] for row in rows):
+                self.mismatched += 1
+                logger.warning(
+                    f"Строки счёта №{record_dict['id']} в диапазоне "
+                    f"{record_dict['sheet_range']} не совпадают с данными счёта."
+                )
+
+        if missing:
+            await db.requeue_outbox(missing)
+            outbox_worker.wake()
+            self.requeued += len(missing)
+            logger.warning(
+                f"Счета №{', '.join(map(str, missing))} не найдены в Google Sheets "
+                f"и повторно поставлены в очередь."
+            )
+
+        recheck_ids = sorted(pending + missing)
+        await db.set_reconciliation_cursor(
+            records[-1]["event_id"] if records else cursor, recheck_ids
+        )
+        self.recheck = len(recheck_ids)
+        self.runs += 1
+        self.checked += len(reconciled)
+        return len(records)
+
+
+reconciler = SheetsReconciler()
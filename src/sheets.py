@@ -1,14 +1,42 @@
-import json
-from datetime import datetime
+import asyncio
+import random
+import re
+from datetime import date, datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
+from typing import TYPE_CHECKING
 
-import gspread_asyncio
-import pandas as pd
 import pytz
-from google.oauth2.service_account import Credentials
 
 from config.config import Config
 from helper.logging_config import logger
+from helper.rate_limiter import TokenBucket
+from src.sheets_backends import create_backend
+
+# gspread и google-auth импортируются хранилищем при первом обращении к Google Sheets,
+# чтобы не замедлять запуск бота
+if TYPE_CHECKING:
+    import gspread_asyncio
+
+
+# столбцы листа счетов, в которые записываются платежи
+RECORDS_TABLE_RANGE = "B:J"
+
+# коды ответов Google API, после которых запрос на чтение имеет смысл повторить
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# запрос на запись повторяется только после ответа 429: при ответе 5xx он мог быть
+# применен, поэтому его повторяет очередь sheets_outbox после проверки таблицы
+WRITE_RETRYABLE_STATUS_CODES = frozenset({429})
+
+# столбцы строки платежа, по которым строка находится в таблице:
+# статья, группа, комментарий и способ оплаты (сумма и месяц сравниваются отдельно)
+PAYMENT_KEY_COLUMNS = (2, 3, 6, 8)
+
+# столбец месяца платежа в строке, подготовленной construct_rows
+PAYMENT_MONTH_COLUMN = 7
+
+# начало отсчета дат Google Sheets: значение без форматирования - число дней от него
+SHEETS_EPOCH = date(1899, 12, 30)
 
 
 async def get_today_moscow_time() -> str:
@@ -27,13 +55,75 @@ async def get_today_moscow_time() -> str:
 async def add_record_to_google_sheet(record_dict: dict) -> None:
     """Функция для добавления строки в таблицу Google Sheet."""
 
-    manager = GoogleSheetsManager()
-    await manager.initialize_google_sheets()
-    await manager.add_payment_to_sheet(record_dict)
+    await sheets_manager.add_payment_to_sheet(record_dict)
+
+
+async def add_rows_to_google_sheet(rows: list[list[str]]) -> str | None:
+    """Функция для добавления подготовленных строк нескольких счетов в таблицу Google Sheet одним запросом."""
+
+    return await sheets_manager.append_payment_rows(rows)
+
+
+async def find_rows_in_google_sheet(
+    searches: list[tuple[str, list[list[str]]]]
+) -> list[str | None]:
+    """Функция для поиска уже записанных строк счетов в диапазонах таблицы Google Sheet."""
+
+    return await sheets_manager.find_payment_rows(searches)
+
+
+def get_range_rows(sheet_range: str) -> tuple[int, int]:
+    """
+    Возвращает номера первой и последней строки диапазона в нотации A1.
+
+    :param sheet_range: Диапазон, например "'Лист'!B120:J121", "B120" или "B120:J".
+    :return: Кортеж из номеров первой и последней строки; для диапазона
+        без последней строки обе равны первой.
+    """
+
+    first_row, last_row = re.search(
+        r"[A-Z]+(\d+)(?::[A-Z]+(\d*))?$", sheet_range
+    ).groups(default=None)
+    return int(first_row), int(last_row or first_row)
+
+
+def sheet_date(value) -> str:
+    """
+    Приводит значение ячейки с датой к формату dd.mm.yyyy.
+
+    :param value: Значение без форматирования: число дней от начала отсчета дат
+        Google Sheets или строка, если ячейка хранит дату текстом.
+    :return: Дата в формате dd.mm.yyyy.
+    """
+
+    if isinstance(value, (int, float)):
+        return (SHEETS_EPOCH + timedelta(days=int(value))).strftime("%d.%m.%Y")
+    return str(value)
+
+
+def rows_match(sheet_row: list, row: list) -> bool:
+    """
+    Проверяет, что строка таблицы совпадает со строкой платежа, подготовленной construct_rows.
+    Дата записи не сравнивается: при повторной записи она может быть другой.
+
+    :param sheet_row: Значения строки таблицы без форматирования, начиная со столбца B.
+    :param row: Строка платежа.
+    :return: True, если строки совпадают.
+    """
+
+    sheet_row = list(sheet_row) + [""] * (len(row) - len(sheet_row))
+    try:
+        if abs(float(sheet_row[1]) - float(row[1])) > 0.005:
+            return False
+    except (TypeError, ValueError):
+        return False
+    if sheet_date(sheet_row[PAYMENT_MONTH_COLUMN]) != row[PAYMENT_MONTH_COLUMN]:
+        return False
+    return all(str(sheet_row[i]) == str(row[i]) for i in PAYMENT_KEY_COLUMNS)
 
 
 async def construct_rows(
-    payment_info: dict[str, str], today_date: str
+    payment_info: dict[str, any], today_date: str
 ) -> list[list[str]]:
     """
     Конструирует строки для обновления в таблице на основе информации о платеже.
@@ -43,7 +133,7 @@ async def construct_rows(
     :return: Список списков строк для добавления в таблицу.
     """
 
-    period = payment_info["period"].split(" ")
+    period = [month.strftime("%d.%m.%Y") for month in payment_info["period"]]
     total_sum = Decimal(payment_info["amount"]) / Decimal(len(period))
     rounded_sum = float(
         total_sum.quantize(Decimal("0.0000000001"), rounding=ROUND_HALF_UP)
@@ -65,134 +155,257 @@ async def construct_rows(
     ]
 
 
-async def apply_formatting(worksheet) -> None:
+async def apply_formatting(worksheet, updated_range: str) -> None:
     """
-    Применяет необходимое форматирование к таблице.
+    Применяет форматирование к только что записанным строкам одним запросом batchUpdate.
 
     :param worksheet: Рабочий лист Google Sheets.
+    :param updated_range: Диапазон записанных строк в нотации A1 (например "'Лист'!B120:J121").
     """
 
+    first_row, last_row = get_range_rows(updated_range)
+
     text_format = {"textFormat": {"fontFamily": "Lato"}}
     date_format = {"numberFormat": {"type": "DATE", "pattern": "dd.mm.yyyy"}}
     currency_format = {"numberFormat": {"type": "CURRENCY", "pattern": "₽ #,###"}}
 
-    await worksheet.format("B:I", text_format)
-    await worksheet.format("B3:B", date_format)
-    await worksheet.format("C3:C", currency_format)
-    await worksheet.format("J3:J", date_format)
-
-
-async def detect_start_row(all_data: list[list[str]]) -> int:
-    """
-    Определяет начальную строку для новых данных на основе существующих данных в таблице.
-
-    :param all_data: Все данные из таблицы.
-    :return: Номер первой пустой строки.
-    """
-
-    return next(
-        (
-            index + 1
-            for index, row in enumerate(all_data)
-            if all(cell == "" for cell in row[:10])
-        ),
-        len(all_data) + 1,
+    await sheets_manager.call(
+        "write",
+        worksheet.batch_format,
+        [
+            {"range": f"B{first_row}:I{last_row}", "format": text_format},
+            {"range": f"B{first_row}:B{last_row}", "format": date_format},
+            {"range": f"C{first_row}:C{last_row}", "format": currency_format},
+            {"range": f"J{first_row}:J{last_row}", "format": date_format},
+        ]
     )
 
 
-async def construct_category_data(df: pd.DataFrame) -> dict[str, list[str]]:
+async def construct_category_data(
+    rows: list[list[str]],
+) -> tuple[dict[str, list[str]], list[str]]:
     """
-    Организует данные о категориях в структурированный словарь и список уникальных элементов.
+    Организует данные о категориях в структурированный словарь и список уникальных элементов
+    за один проход по строкам листа.
 
-    :param df: DataFrame с данными о категориях.
+    :param rows: Строки листа "категории" без заголовка: статья и группа.
     :return: Словарь с категориями и список уникальных элементов.
     """
 
-    data_structure = {}
-    unique_items = df["Статья"].unique().tolist()
+    # словари используются как упорядоченные множества: порядок первого появления
+    # сохраняется, а проверка на дубликат не требует прохода по списку
+    groups_by_item: dict[str, dict[str, None]] = {}
+    for row in rows:
+        if len(row) < 2:
+            continue
+        item, group = row[0], row[1]
+        groups_by_item.setdefault(item, {})[group] = None
 
-    for _, row in df.iterrows():
-        category = row["Статья"]
-        group = row["Группа"]
+    data_structure = {item: list(groups) for item, groups in groups_by_item.items()}
+    return data_structure, list(data_structure)
 
-        if category not in data_structure:
-            data_structure[category] = []
 
-        if group not in data_structure[category]:
-            data_structure[category].append(group)
-
-    return data_structure, unique_items
+async def update_worksheet(worksheet, rows_to_update: list[list[str]]) -> str:
+    """
+    Дописывает строки после последней заполненной строки таблицы и применяет форматирование.
 
+    Используется метод append Sheets API: таблица сама определяет первую
+    свободную строку, поэтому лист не скачивается целиком.
 
-async def update_worksheet(
-    worksheet, rows_to_update: list[list[str]], start_row: int
-) -> None:
-    """
-    Обновляет таблицу с новыми данными и применяет форматирование.
+    Ошибка форматирования только записывается в журнал: строки уже добавлены,
+    и повтор всей записи дописал бы их второй раз.
 
     :param worksheet: Работа лист Google Sheets.
-    :param rows_to_update: Список строк для обновления.
-    :param start_row: Номер первой строки для обновления.
+    :param rows_to_update: Список строк для добавления.
+    :return: Диапазон, в который были записаны строки, в нотации A1.
     """
 
-    await worksheet.update(
-        f"B{start_row}:K{start_row + len(rows_to_update) - 1}",
+    response = await sheets_manager.call(
+        "write",
+        worksheet.append_rows,
         rows_to_update,
         value_input_option="USER_ENTERED",
+        insert_data_option="OVERWRITE",
+        table_range=RECORDS_TABLE_RANGE,
     )
-    logger.info(f"Добавлено {len(rows_to_update)} row, начиная с строки {start_row}")
+    updated_range = response["updates"]["updatedRange"]
+    logger.info(f"Добавлено {len(rows_to_update)} row в диапазон {updated_range}")
 
-    await apply_formatting(worksheet)
+    try:
+        await apply_formatting(worksheet, updated_range)
+    except Exception as e:
+        logger.error(f"Не удалось отформатировать диапазон {updated_range}: {e}")
+    return updated_range
 
 
 class GoogleSheetsManager:
     """Класс для обработки Google Sheets таблиц."""
 
     def __init__(self):
-        """Инициализирует класс GoogleSheetsManager."""
+        """
+        Инициализирует класс GoogleSheetsManager.
+
+        Хранилище таблиц выбирается по SHEETS_BACKEND. Таблица и листы
+        открываются при первом обращении и переиспользуются до переавторизации.
+        """
 
         self.sheets_spreadsheet_id = Config.google_sheets_spreadsheet_id
         self.records_sheet_id = Config.google_sheets_records_sheet_id
         self.categories_sheet_id = Config.google_sheets_categories_sheet_id
         self.options_dict = None
         self.items = None
-        self.agc = None
+        self.backend = create_backend()
+        self._spreadsheet = None
+        self._worksheets = {}
+        # квоты Sheets API считаются отдельно для чтения и записи
+        self._limiters = {
+            kind: TokenBucket(quota / 60, Config.sheets_rate_burst)
+            for kind, quota in (
+                ("read", Config.sheets_read_quota),
+                ("write", Config.sheets_write_quota),
+            )
+        }
+        self.retries = 0
+        self.failures = 0
+
+    async def call(self, kind: str, func, *args, **kwargs):
+        """
+        Выполняет запрос к Google API с учетом квоты и повторяет его
+        с экспоненциальной задержкой со случайным разбросом: запрос на чтение -
+        при ответах 429 и 5xx, сетевых ошибках и истечении времени ожидания,
+        запрос на запись - только при ответе 429.
+
+        Каждая попытка ограничена SHEETS_REQUEST_TIMEOUT секундами, чтобы запрос
+        не пережил аренду записей очереди sheets_outbox (SHEETS_OUTBOX_LEASE).
+
+        :param kind: Вид квоты: "read" или "write".
+        :param func: Асинхронный метод клиента gspread_asyncio.
+        :return: Результат метода.
+        :raises Exception: Если запрос не удался после всех попыток.
+        """
 
-    @staticmethod
-    def get_credentials() -> Credentials:
+        limiter = self._limiters[kind]
+        retryable = (
+            RETRYABLE_STATUS_CODES if kind == "read" else WRITE_RETRYABLE_STATUS_CODES
+        )
+        for attempt in range(Config.sheets_retry_attempts):
+            await limiter.acquire()
+            try:
+                return await asyncio.wait_for(
+                    func(*args, **kwargs), Config.sheets_request_timeout
+                )
+            except Exception as e:
+                response = getattr(e, "response", None)
+                status_code = getattr(response, "status_code", None)
+                # сетевые ошибки requests и истечение времени ожидания - наследники OSError
+                network_error = response is None and isinstance(e, OSError)
+                if (
+                    not (status_code in retryable or (kind == "read" and network_error))
+                    or attempt + 1 >= Config.sheets_retry_attempts
+                ):
+                    self.failures += 1
+                    raise
+
+                if status_code == 429:
+                    limiter.drain()
+                retry_after = (
+                    response.headers.get("Retry-After", "") if response is not None else ""
+                )
+                delay = (
+                    float(retry_after)
+                    if retry_after.isdigit()
+                    else min(
+                        Config.sheets_retry_backoff_base * 2**attempt,
+                        Config.sheets_retry_backoff_max,
+                    )
+                    * random.uniform(0.5, 1.5)
+                )
+                self.retries += 1
+                logger.warning(
+                    f"Запрос к Google API не удался ({status_code or repr(e)}), "
+                    f"повтор через {delay:.1f} с."
+                )
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict[str, int | dict]:
         """
-        Получает учетные данные для доступа к Google Sheets API.
+        Возвращает счетчики ожиданий квоты и повторов запросов к Google API.
 
-        :return: Объект Credentials с необходимыми разрешениями.
+        :return: Словарь со счетчиками
         """
 
-        credentials_string = Config.google_sheets_credentials_file
-        credentials_data = json.loads(credentials_string)
+        stats = {
+            "backend": Config.sheets_backend,
+            "throttle": {kind: limiter.stats() for kind, limiter in self._limiters.items()},
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+        if hasattr(self.backend, "stats"):
+            stats["local"] = self.backend.stats()
+        return stats
+
+    async def get_spreadsheet(self) -> "gspread_asyncio.AsyncioGspreadSpreadsheet":
+        """
+        Возвращает таблицу, открывая её только при первом обращении.
+        При смене клиента хранилища сохраненные таблица и листы сбрасываются.
 
-        creds = Credentials.from_service_account_info(credentials_data)
-        return creds.with_scopes(
-            [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/spreadsheets",
-                "https://www.googleapis.com/auth/drive",
-            ]
-        )
+        :return: Таблица Google Sheets.
+        """
+
+        if await self.backend.authorize():
+            self._spreadsheet = None
+            self._worksheets.clear()
+        if self._spreadsheet is None:
+            self._spreadsheet = await self.call(
+                "read", self.backend.open_spreadsheet, self.sheets_spreadsheet_id
+            )
+        return self._spreadsheet
+
+    async def get_worksheet(
+        self, sheet_id: int | str
+    ) -> "gspread_asyncio.AsyncioGspreadWorksheet":
+        """
+        Возвращает лист таблицы по ID, открывая таблицу и лист только при первом обращении.
+
+        :param sheet_id: ID листа таблицы.
+        :return: Лист Google Sheets.
+        """
 
-    async def initialize_google_sheets(self) -> gspread_asyncio.AsyncioGspreadClient:
+        spreadsheet = await self.get_spreadsheet()
+        worksheet = self._worksheets.get(sheet_id)
+        if worksheet is None:
+            worksheet = await self.call(
+                "read", spreadsheet.get_worksheet_by_id, sheet_id
+            )
+            self._worksheets[sheet_id] = worksheet
+        return worksheet
+
+    async def get_revision(self) -> str:
         """
-        Инициализирует асинхронный клиент для работы с Google Sheets.
+        Возвращает ревизию таблицы: для Google Sheets - время последнего изменения
+        по метаданным файла в Google Drive.
+
+        Запрос метаданных намного легче чтения листа, поэтому по нему проверяется,
+        нужно ли заново загружать категории. Ревизия меняется при любом изменении
+        таблицы, в том числе при записи платежей.
 
-        :return: Асинхронный клиент для работы с Google Sheets.
+        :return: Ревизия таблицы.
+        """
+
+        spreadsheet = await self.get_spreadsheet()
+        return await self.call("read", self.backend.get_revision, spreadsheet)
+
+    async def startup(self) -> None:
+        """
+        Авторизуется в Google Sheets и открывает листы при запуске бота.
+        Ошибка не прерывает запуск: авторизация будет повторена при первом обращении.
         """
 
         try:
-            agcm = gspread_asyncio.AsyncioGspreadClientManager(self.get_credentials)
-            self.agc = await agcm.authorize()
-            logger.info("Успешная авторизация Google Sheets.")
-            return self.agc
+            await self.get_worksheet(self.records_sheet_id)
+            await self.get_worksheet(self.categories_sheet_id)
         except Exception as e:
-            logger.error(f"Авторизация не удалась: {e}")
-            raise RuntimeError(f"Авторизация не удалась: {e}")
+            logger.error(f"Не удалось подготовить Google Sheets при запуске: {e}")
 
     async def add_payment_to_sheet(self, payment_info: dict[str, str]) -> None:
         """
@@ -201,22 +414,103 @@ class GoogleSheetsManager:
         :param payment_info: Словарь с данными о платеже.
         """
 
-        try:
-            spreadsheet = await self.agc.open_by_key(self.sheets_spreadsheet_id)
-            worksheet = await spreadsheet.get_worksheet_by_id(self.records_sheet_id)
-            all_data = await worksheet.get_all_values()
-            today_date = await get_today_moscow_time()
-            rows_to_update = await construct_rows(payment_info, today_date)
-            start_row = await detect_start_row(all_data)
+        today_date = await get_today_moscow_time()
+        await self.append_payment_rows(await construct_rows(payment_info, today_date))
 
-            if rows_to_update:
-                await update_worksheet(worksheet, rows_to_update, start_row)
+    async def append_payment_rows(self, rows: list[list[str]]) -> str | None:
+        """
+        Дописывает строки платежей в таблицу Google Sheets одним запросом append
+        и форматирует их одним запросом batchUpdate, сохраняя порядок строк.
+
+        :param rows: Строки, подготовленные функцией construct_rows.
+        :return: Диапазон, в который были записаны строки, в нотации A1.
+        :raises RuntimeError: Если не удалось записать строки.
+        """
+
+        if not rows:
+            return None
+
+        try:
+            worksheet = await self.get_worksheet(self.records_sheet_id)
+            return await update_worksheet(worksheet, rows)
 
         except Exception as e:
             logger.error(f"Не удалось добавить платеж в таблицу: {e}")
             raise RuntimeError(f"Не удалось добавить платеж в таблицу: {e}")
 
-    async def get_data(self) -> tuple[dict[str, dict[str, list[str]]], list[str]]:
+    async def get_payment_ranges(self, sheet_ranges: list[str]) -> list[list[list[str]]]:
+        """
+        Читает несколько диапазонов листа счетов одним запросом batchGet.
+
+        :param sheet_ranges: Диапазоны в нотации A1 без имени листа.
+        :return: Значения ячеек каждого диапазона в том же порядке.
+        """
+
+        if not sheet_ranges:
+            return []
+
+        worksheet = await self.get_worksheet(self.records_sheet_id)
+        return await self.call("read", worksheet.batch_get, sheet_ranges)
+
+    async def find_payment_rows(
+        self, searches: list[tuple[str, list[list]]]
+    ) -> list[str | None]:
+        """
+        Ищет строки платежей в диапазонах листа счетов; все диапазоны читаются одним запросом.
+
+        Нужен перед повторной записью счёта, предыдущая попытка записи которого
+        могла быть применена: строки такого счёта не дописываются второй раз.
+
+        :param searches: Пары из диапазона в нотации A1 без имени листа и строк платежа,
+            подготовленных функцией construct_rows.
+        :return: Диапазон найденных строк каждого платежа или None, в том же порядке;
+            в диапазонах, начинающихся с первой строки листа, строки не ищутся.
+        """
+
+        # диапазон от первой строки - весь лист: в нем нашлись бы старые оплаты
+        # с теми же данными, поэтому в нем не ищется
+        ranges = list(
+            dict.fromkeys(
+                sheet_range
+                for sheet_range, _ in searches
+                if get_range_rows(sheet_range)[0] > 1
+            )
+        )
+        if not ranges:
+            return [None] * len(searches)
+
+        worksheet = await self.get_worksheet(self.records_sheet_id)
+        values = await self.call(
+            "read",
+            worksheet.batch_get,
+            ranges,
+            value_render_option="UNFORMATTED_VALUE",
+        )
+        values_by_range = dict(zip(ranges, values))
+
+        # одни и те же строки таблицы не засчитываются двум одинаковым платежам
+        used_rows = set()
+        found = []
+        for sheet_range, rows in searches:
+            if sheet_range not in values_by_range:
+                found.append(None)
+                continue
+            sheet_rows = values_by_range[sheet_range]
+            first_row = get_range_rows(sheet_range)[0]
+            found_range = None
+            for offset in range(len(sheet_rows) - len(rows) + 1):
+                matched = range(first_row + offset, first_row + offset + len(rows))
+                if used_rows.isdisjoint(matched) and all(
+                    rows_match(sheet_rows[offset + i], row)
+                    for i, row in enumerate(rows)
+                ):
+                    used_rows.update(matched)
+                    found_range = f"B{matched[0]}:J{matched[-1]}"
+                    break
+            found.append(found_range)
+        return found
+
+    async def get_data(self) -> tuple[dict[str, list[str]], list[str]]:
         """
         Получает статью, группу и партнёров Google Sheets в виде структурированного словаря и списка
         уникальных элементов.
@@ -225,17 +519,13 @@ class GoogleSheetsManager:
         """
 
         try:
-            spreadsheet = await self.agc.open_by_key(self.sheets_spreadsheet_id)
-            worksheet = await spreadsheet.get_worksheet_by_id(self.categories_sheet_id)
-            all_values = await worksheet.get_all_values()
-            if all_values:
-                filtered_values = [row[:2] for row in all_values[1:]]
-            else:
-                filtered_values = []
-            df = pd.DataFrame(filtered_values, columns=["Статья", "Группа"])
-            df.dropna(subset=["Статья", "Группа"], inplace=True)
-
-            return await construct_category_data(df)
+            worksheet = await self.get_worksheet(self.categories_sheet_id)
+            all_values = await self.call("read", worksheet.get_all_values)
+
+            return await construct_category_data(all_values[1:])
         except Exception as e:
             logger.error(f"Не удалось прочитать данные категорий: {e}")
             raise RuntimeError(f"Не удалось прочитать данные категорий: {e}")
+
+
+sheets_manager = GoogleSheetsManager()
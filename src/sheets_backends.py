@@ -0,0 +1,607 @@
+import asyncio
+import csv
+import json
+import os
+import random
+import re
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from config.config import Config
+from helper.logging_config import logger
+
+if TYPE_CHECKING:
+    import gspread_asyncio
+    from google.oauth2.service_account import Credentials
+
+
+class SheetsBackend(ABC):
+    """
+    Интерфейс хранилища таблиц для GoogleSheetsManager.
+
+    Таблица, которую возвращает open_spreadsheet, должна поддерживать метод
+    get_worksheet_by_id, а ее листы - методы append_rows, batch_format,
+    get_all_values и batch_get с сигнатурами gspread_asyncio.
+    """
+
+    @abstractmethod
+    async def authorize(self) -> bool:
+        """
+        Готовит клиента хранилища к работе.
+
+        :return: True, если клиент был создан заново и открытые таблицы нужно сбросить.
+        """
+
+    @abstractmethod
+    async def open_spreadsheet(self, spreadsheet_id: str):
+        """
+        Открывает таблицу по ID.
+
+        :param spreadsheet_id: ID таблицы.
+        :return: Таблица.
+        """
+
+    @abstractmethod
+    async def get_revision(self, spreadsheet) -> str:
+        """
+        Возвращает строку, которая меняется при каждом изменении таблицы.
+
+        :param spreadsheet: Таблица, открытая методом open_spreadsheet.
+        :return: Ревизия таблицы.
+        """
+
+
+def create_client_manager(credentials_fn) -> "gspread_asyncio.AsyncioGspreadClientManager":
+    """
+    Создает менеджер клиента gspread_asyncio, который не повторяет запросы сам.
+
+    По умолчанию gspread_asyncio бесконечно повторяет запросы после ответов 429, 5xx
+    и сетевых ошибок, поэтому ошибки не доходят до GoogleSheetsManager.call,
+    а запрос на запись, примененный сервером до ответа 5xx, отправляется повторно.
+    Здесь обработчики ошибок пробрасывают их дальше, и повторами управляет только call.
+
+    :param credentials_fn: Функция, возвращающая учетные данные.
+    :return: Менеджер клиента.
+    """
+
+    import gspread_asyncio
+
+    class ClientManager(gspread_asyncio.AsyncioGspreadClientManager):
+        """Менеджер клиента gspread_asyncio без собственных повторов запросов"""
+
+        async def handle_gspread_error(self, e, method, args, kwargs):
+            raise e
+
+        async def handle_requests_error(self, e, method, args, kwargs):
+            raise e
+
+    return ClientManager(
+        credentials_fn, reauth_interval=Config.google_sheets_reauth_interval
+    )
+
+
+class GoogleSheetsBackend(SheetsBackend):
+    """Хранилище таблиц в Google Sheets через gspread_asyncio"""
+
+    def __init__(self):
+        """
+        Инициализирует объект GoogleSheetsBackend.
+
+        Авторизованный клиент создается при первом обращении
+        и переиспользуется до переавторизации.
+        """
+
+        self.agc = None
+        self._credentials = None
+        self._agcm = None
+
+    def get_credentials(self) -> "Credentials":
+        """
+        Получает учетные данные для доступа к Google Sheets API.
+        JSON с учетными данными разбирается один раз за время жизни процесса.
+
+        :return: Объект Credentials с необходимыми разрешениями.
+        """
+
+        if self._credentials is None:
+            from google.oauth2.service_account import Credentials
+
+            credentials_string = Config.google_sheets_credentials_file
+            credentials_data = json.loads(credentials_string)
+
+            creds = Credentials.from_service_account_info(credentials_data)
+            self._credentials = creds.with_scopes(
+                [
+                    "https://spreadsheets.google.com/feeds",
+                    "https://www.googleapis.com/auth/spreadsheets",
+                    "https://www.googleapis.com/auth/drive",
+                ]
+            )
+        return self._credentials
+
+    async def authorize(self) -> bool:
+        """
+        Возвращает признак смены авторизованного асинхронного клиента Google Sheets.
+
+        Клиент создается один раз и переавторизуется менеджером клиента заранее,
+        до истечения срока действия токена (GOOGLE_SHEETS_REAUTH_INTERVAL минут).
+
+        :return: True, если клиент был создан заново.
+        """
+
+        try:
+            if self._agcm is None:
+                self._agcm = create_client_manager(self.get_credentials)
+            agc = await asyncio.wait_for(
+                self._agcm.authorize(), Config.sheets_request_timeout
+            )
+            if agc is self.agc:
+                return False
+            self.agc = agc
+            logger.info("Успешная авторизация Google Sheets.")
+            return True
+        except Exception as e:
+            logger.error(f"Авторизация не удалась: {e}")
+            raise RuntimeError(f"Авторизация не удалась: {e}")
+
+    async def open_spreadsheet(
+        self, spreadsheet_id: str
+    ) -> "gspread_asyncio.AsyncioGspreadSpreadsheet":
+        """
+        Открывает таблицу Google Sheets по ключу.
+
+        :param spreadsheet_id: Ключ таблицы.
+        :return: Таблица Google Sheets.
+        """
+
+        return await self.agc.open_by_key(spreadsheet_id)
+
+    async def get_revision(self, spreadsheet) -> str:
+        """
+        Возвращает время последнего изменения таблицы по метаданным файла в Google Drive.
+
+        :param spreadsheet: Таблица Google Sheets.
+        :return: Время последнего изменения таблицы в формате RFC 3339.
+        """
+
+        return await asyncio.to_thread(spreadsheet.ss.get_lastUpdateTime)
+
+
+class FakeResponse:
+    """Ответ сервера, который имитирует локальное хранилище при ошибке квоты"""
+
+    status_code = 429
+    headers = {}
+
+
+class FakeQuotaError(Exception):
+    """Имитация ответа 429 Google API, повторяемая слоем GoogleSheetsManager.call"""
+
+    def __init__(self):
+        super().__init__("Имитация превышения квоты Google Sheets API")
+        self.response = FakeResponse()
+
+
+def column_index(letters: str) -> int:
+    """
+    Переводит буквенное обозначение столбца в индекс, начиная с нуля.
+
+    :param letters: Буквы столбца, например "B" или "AA".
+    :return: Индекс столбца.
+    """
+
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def column_letters(index: int) -> str:
+    """
+    Переводит индекс столбца, начиная с нуля, в буквенное обозначение.
+
+    :param index: Индекс столбца.
+    :return: Буквы столбца.
+    """
+
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def parse_range(sheet_range: str) -> tuple[int, int | None, int, int | None]:
+    """
+    Разбирает диапазон в нотации A1 без имени листа.
+
+    :param sheet_range: Диапазон, например "B2:J10", "B2:J" или "B:J".
+    :return: Индексы первого столбца, первой строки, последнего столбца и последней строки;
+        первая строка равна None, если диапазон начинается с целого столбца,
+        последняя - если он продолжается до конца листа.
+    """
+
+    match = re.fullmatch(r"([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?", sheet_range.split("!")[-1])
+    first_col, first_row, last_col, last_row = match.groups()
+    if last_col is None:
+        last_col, last_row = first_col, first_row
+    return (
+        column_index(first_col),
+        int(first_row) - 1 if first_row else None,
+        column_index(last_col),
+        int(last_row) - 1 if last_row else None,
+    )
+
+
+class LocalWorksheet:
+    """Лист локального хранилища: сетка строк в памяти процесса"""
+
+    def __init__(self, backend: "MemorySheetsBackend", sheet_id: str, rows: list[list]):
+        """
+        Инициализирует объект LocalWorksheet.
+
+        :param backend: Хранилище, которому принадлежит лист.
+        :param sheet_id: ID листа.
+        :param rows: Начальные строки листа.
+        """
+
+        self.backend = backend
+        self.id = sheet_id
+        self.title = str(sheet_id)
+        self.rows = rows
+
+    async def append_rows(
+        self,
+        values: list[list],
+        value_input_option: str | None = None,
+        insert_data_option: str | None = None,
+        table_range: str | None = None,
+    ) -> dict:
+        """
+        Дописывает строки после последней заполненной строки диапазона table_range.
+
+        :param values: Строки для записи.
+        :return: Ответ в формате Sheets API с диапазоном записанных строк.
+        """
+
+        await self.backend.simulate_request()
+        self.backend.reload(self)
+        first_col, _, last_col, _ = parse_range(table_range or "A:Z")
+        start = len(self.rows)
+        while start and not any(self.rows[start - 1][first_col : last_col + 1]):
+            start -= 1
+
+        for offset, row in enumerate(values):
+            index = start + offset
+            while len(self.rows) <= index:
+                self.rows.append([])
+            target = self.rows[index]
+            target.extend([""] * (first_col + len(row) - len(target)))
+            target[first_col : first_col + len(row)] = row
+
+        self.backend.changed(self)
+        end_col = column_letters(first_col + max(len(row) for row in values) - 1)
+        return {
+            "updates": {
+                "updatedRange": f"'{self.title}'!{column_letters(first_col)}{start + 1}"
+                f":{end_col}{start + len(values)}"
+            }
+        }
+
+    async def batch_format(self, formats: list[dict]) -> dict:
+        """
+        Принимает запрос форматирования; локальное хранилище форматирование не хранит.
+
+        :param formats: Диапазоны и форматы.
+        :return: Пустой ответ.
+        """
+
+        await self.backend.simulate_request()
+        return {}
+
+    async def get_all_values(self) -> list[list[str]]:
+        """
+        Возвращает все строки листа, дополненные пустыми ячейками до одинаковой длины.
+
+        :return: Значения ячеек листа.
+        """
+
+        await self.backend.simulate_request()
+        self.backend.reload(self)
+        width = max((len(row) for row in self.rows), default=0)
+        return [
+            [str(cell) for cell in row] + [""] * (width - len(row)) for row in self.rows
+        ]
+
+    async def batch_get(
+        self, ranges: list[str], value_render_option: str | None = None
+    ) -> list[list[list[str]]]:
+        """
+        Возвращает значения нескольких диапазонов без пустых строк и столбцов в конце.
+
+        :param ranges: Диапазоны в нотации A1.
+        :param value_render_option: Вид значений (не используется: ячейки хранятся как есть).
+        :return: Значения ячеек каждого диапазона.
+        """
+
+        await self.backend.simulate_request()
+        self.backend.reload(self)
+        result = []
+        for sheet_range in ranges:
+            first_col, first_row, last_col, last_row = parse_range(sheet_range)
+            first_row = first_row or 0
+            last_row = len(self.rows) - 1 if last_row is None else last_row
+            values = []
+            for row in self.rows[first_row : last_row + 1]:
+                cells = [str(cell) for cell in row[first_col : last_col + 1]]
+                while cells and not cells[-1]:
+                    cells.pop()
+                values.append(cells)
+            while values and not values[-1]:
+                values.pop()
+            result.append(values)
+        return result
+
+
+class LocalSpreadsheet:
+    """Таблица локального хранилища"""
+
+    def __init__(self, backend: "MemorySheetsBackend"):
+        """
+        Инициализирует объект LocalSpreadsheet.
+
+        :param backend: Хранилище, которому принадлежит таблица.
+        """
+
+        self.backend = backend
+        self.worksheets: dict[str, LocalWorksheet] = {}
+
+    async def get_worksheet_by_id(self, sheet_id: int | str) -> LocalWorksheet:
+        """
+        Возвращает лист по ID, создавая пустой лист при первом обращении.
+
+        :param sheet_id: ID листа.
+        :return: Лист локального хранилища.
+        """
+
+        await self.backend.simulate_request()
+        sheet_id = str(sheet_id)
+        if sheet_id not in self.worksheets:
+            self.worksheets[sheet_id] = LocalWorksheet(
+                self.backend, sheet_id, self.backend.load_rows(sheet_id)
+            )
+        return self.worksheets[sheet_id]
+
+
+class MemorySheetsBackend(SheetsBackend):
+    """
+    Хранилище таблиц в памяти процесса для тестов и нагрузочных замеров без сети.
+
+    Начальные строки листов читаются из файлов {ID листа}.csv каталога
+    SHEETS_MEMORY_SEED_DIR, если он задан; изменения в файлы не записываются.
+    Каждый запрос задерживается на SHEETS_FAKE_LATENCY секунд и с вероятностью
+    SHEETS_FAKE_ERROR_RATE завершается имитацией ответа 429.
+    """
+
+    def __init__(
+        self,
+        data_dir: str | None = None,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        """
+        Инициализирует объект MemorySheetsBackend.
+
+        :param data_dir: Каталог с CSV файлами листов ({ID листа}.csv) для начального заполнения.
+        :param latency: Задержка каждого запроса в секундах.
+        :param error_rate: Доля запросов, завершающихся ошибкой квоты.
+        """
+
+        self.data_dir = data_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.spreadsheet = LocalSpreadsheet(self)
+        self.revision = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def simulate_request(self) -> None:
+        """
+        Имитирует сетевую задержку и ошибки квоты.
+
+        :raises FakeQuotaError: С вероятностью error_rate.
+        """
+
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            raise FakeQuotaError()
+
+    def csv_path(self, sheet_id: str) -> str | None:
+        """
+        Возвращает путь к CSV файлу листа.
+
+        :param sheet_id: ID листа.
+        :return: Путь к файлу или None, если каталог не задан.
+        """
+
+        return os.path.join(self.data_dir, f"{sheet_id}.csv") if self.data_dir else None
+
+    def load_rows(self, sheet_id: str) -> list[list]:
+        """
+        Загружает начальные строки листа из CSV файла, если он есть.
+
+        :param sheet_id: ID листа.
+        :return: Строки листа.
+        """
+
+        path = self.csv_path(sheet_id)
+        if not path or not os.path.exists(path):
+            return []
+        with open(path, newline="", encoding="utf-8") as file:
+            return [row for row in csv.reader(file)]
+
+    def changed(self, worksheet: LocalWorksheet) -> None:
+        """
+        Отмечает изменение листа.
+
+        :param worksheet: Измененный лист.
+        """
+
+        self.revision += 1
+
+    def reload(self, worksheet: LocalWorksheet) -> None:
+        """
+        Перечитывает лист, если он был изменен вне процесса.
+        Лист в памяти изменяется только самим процессом.
+
+        :param worksheet: Лист локального хранилища.
+        """
+
+    async def authorize(self) -> bool:
+        """
+        Локальному хранилищу авторизация не нужна.
+
+        :return: False
+        """
+
+        return False
+
+    async def open_spreadsheet(self, spreadsheet_id: str) -> LocalSpreadsheet:
+        """
+        Возвращает единственную таблицу локального хранилища.
+
+        :param spreadsheet_id: ID таблицы (не используется).
+        :return: Таблица локального хранилища.
+        """
+
+        await self.simulate_request()
+        return self.spreadsheet
+
+    async def get_revision(self, spreadsheet: LocalSpreadsheet) -> str:
+        """
+        Возвращает номер изменения таблицы.
+
+        :param spreadsheet: Таблица локального хранилища.
+        :return: Ревизия таблицы.
+        """
+
+        await self.simulate_request()
+        return str(self.revision)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Возвращает счетчики запросов к локальному хранилищу.
+
+        :return: Словарь со счетчиками
+        """
+
+        return {"requests": self.requests, "errors": self.errors}
+
+
+class CsvSheetsBackend(MemorySheetsBackend):
+    """
+    Хранилище таблиц в CSV файлах: каждый лист хранится в файле {ID листа}.csv
+    каталога SHEETS_LOCAL_DIR и перезаписывается после каждой записи.
+    """
+
+    def __init__(self, data_dir: str, latency: float = 0.0, error_rate: float = 0.0):
+        """
+        Инициализирует объект CsvSheetsBackend.
+
+        :param data_dir: Каталог с CSV файлами листов.
+        :param latency: Задержка каждого запроса в секундах.
+        :param error_rate: Доля запросов, завершающихся ошибкой квоты.
+        """
+
+        super().__init__(data_dir, latency, error_rate)
+        os.makedirs(data_dir, exist_ok=True)
+        # время изменения файла каждого листа на момент его чтения или записи
+        self._mtimes: dict[str, float] = {}
+
+    def _mtime(self, sheet_id: str) -> float | None:
+        """
+        Возвращает время изменения CSV файла листа.
+
+        :param sheet_id: ID листа.
+        :return: Время изменения или None, если файла нет.
+        """
+
+        path = self.csv_path(sheet_id)
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def load_rows(self, sheet_id: str) -> list[list]:
+        """
+        Загружает строки листа из CSV файла и запоминает время его изменения.
+
+        :param sheet_id: ID листа.
+        :return: Строки листа.
+        """
+
+        self._mtimes[sheet_id] = self._mtime(sheet_id)
+        return super().load_rows(sheet_id)
+
+    def changed(self, worksheet: LocalWorksheet) -> None:
+        """
+        Сохраняет измененный лист в CSV файл.
+
+        :param worksheet: Измененный лист.
+        """
+
+        super().changed(worksheet)
+        path = self.csv_path(worksheet.id)
+        with open(f"{path}.tmp", "w", newline="", encoding="utf-8") as file:
+            csv.writer(file).writerows(worksheet.rows)
+        os.replace(f"{path}.tmp", path)
+        self._mtimes[worksheet.id] = self._mtime(worksheet.id)
+
+    def reload(self, worksheet: LocalWorksheet) -> None:
+        """
+        Перечитывает лист, если его CSV файл был изменен вне процесса.
+
+        :param worksheet: Лист локального хранилища.
+        """
+
+        if self._mtime(worksheet.id) != self._mtimes.get(worksheet.id):
+            worksheet.rows = self.load_rows(worksheet.id)
+            super().changed(worksheet)
+
+    async def get_revision(self, spreadsheet: LocalSpreadsheet) -> str:
+        """
+        Возвращает номер изменения таблицы с учетом правок CSV файлов вне процесса.
+
+        :param spreadsheet: Таблица локального хранилища.
+        :return: Ревизия таблицы.
+        """
+
+        for worksheet in spreadsheet.worksheets.values():
+            self.reload(worksheet)
+        return await super().get_revision(spreadsheet)
+
+
+def create_backend() -> SheetsBackend:
+    """
+    Создает хранилище таблиц по значению SHEETS_BACKEND: google, memory или csv.
+
+    :return: Хранилище таблиц.
+    :raises ValueError: Если значение SHEETS_BACKEND неизвестно.
+    """
+
+    if Config.sheets_backend == "google":
+        return GoogleSheetsBackend()
+    if Config.sheets_backend == "memory":
+        return MemorySheetsBackend(
+            Config.sheets_memory_seed_dir,
+            Config.sheets_fake_latency,
+            Config.sheets_fake_error_rate,
+        )
+    if Config.sheets_backend == "csv":
+        return CsvSheetsBackend(
+            Config.sheets_local_dir,
+            Config.sheets_fake_latency,
+            Config.sheets_fake_error_rate,
+        )
+    raise ValueError(f"Неизвестное хранилище таблиц SHEETS_BACKEND: {Config.sheets_backend}")